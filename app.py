@@ -2,82 +2,925 @@ import os
 import json
 import uuid
 import time
+import io
+import hashlib
+import math
+import functools
+import re
+import wave
+import queue
+import random
+import numpy as np
 import requests
-from smallestai import WavesClient
+from requests.adapters import HTTPAdapter
+import threading
+import multiprocessing
+from contextlib import contextmanager
+from concurrent.futures import ThreadPoolExecutor, ProcessPoolExecutor, as_completed, wait
+import smallestai.waves.waves_client as waves_client
 import streamlit as st
+from streamlit import runtime as streamlit_runtime
 import openai
 import fitz  # PyMuPDF
-from moviepy.editor import ImageClip, concatenate_videoclips, AudioFileClip, CompositeAudioClip, VideoFileClip
+from moviepy.editor import ImageClip, VideoClip, concatenate_videoclips, AudioFileClip
+from moviepy.audio.AudioClip import AudioArrayClip
+from moviepy.config import get_setting
+from PIL import Image, ImageOps
+import subprocess
 import tempfile
+import cProfile
+import pstats
 from dotenv import load_dotenv
+try:
+    import fcntl
+except ImportError:  # Windows
+    fcntl = None
 
 # Load environment variables
 load_dotenv('mdb.env')
 
+# Maximum number of in-flight requests and requests per second (0 = unlimited) per provider
+PROVIDER_CONCURRENCY = {
+    "smallest": int(os.getenv("SMALLEST_MAX_CONCURRENCY", "4")),
+    "stability": int(os.getenv("STABILITY_MAX_CONCURRENCY", "4")),
+    "dalle": int(os.getenv("DALLE_MAX_CONCURRENCY", "2")),
+    "openai": int(os.getenv("OPENAI_MAX_CONCURRENCY", "4")),
+}
+PROVIDER_RATE = {
+    "smallest": float(os.getenv("SMALLEST_MAX_RPS", "5")),
+    "stability": float(os.getenv("STABILITY_MAX_RPS", "10")),
+    "dalle": float(os.getenv("DALLE_MAX_RPS", "1")),
+    "openai": float(os.getenv("OPENAI_MAX_RPS", "3")),
+}
+# Transient provider failures are retried with exponential backoff and full jitter, or after Retry-After
+PROVIDER_MAX_RETRIES = int(os.getenv("PROVIDER_MAX_RETRIES", "4"))
+PROVIDER_BACKOFF_BASE = float(os.getenv("PROVIDER_BACKOFF_BASE", "1.0"))
+PROVIDER_BACKOFF_MAX = float(os.getenv("PROVIDER_BACKOFF_MAX", "30"))
+
+
+class ProviderLimiter:
+    """Token bucket (rate requests/second) plus a concurrency cap for one provider.
+
+    The state lives in multiprocessing primitives, so threads and batch worker
+    processes that share a limiter draw from the same quota.
+    """
+
+    def __init__(self, rate, concurrency):
+        self.rate = rate
+        self.burst = max(1.0, rate)
+        self._slots = multiprocessing.BoundedSemaphore(max(1, concurrency))
+        self._lock = multiprocessing.Lock()
+        self._tokens = multiprocessing.RawValue("d", self.burst)
+        self._updated = multiprocessing.RawValue("d", time.time())
+        self._blocked_until = multiprocessing.RawValue("d", 0.0)
+
+    def _wait_time(self):
+        """Take a token and return 0, or return how long to wait before trying again."""
+        with self._lock:
+            now = time.time()
+            if now < self._blocked_until.value:
+                return self._blocked_until.value - now
+            if self.rate <= 0:
+                return 0.0
+            self._tokens.value = min(self.burst, self._tokens.value + (now - self._updated.value) * self.rate)
+            self._updated.value = now
+            if self._tokens.value >= 1:
+                self._tokens.value -= 1
+                return 0.0
+            return (1 - self._tokens.value) / self.rate
+
+    def acquire(self):
+        self._slots.acquire()
+        try:
+            while True:
+                wait_time = self._wait_time()
+                if wait_time <= 0:
+                    return
+                time.sleep(wait_time)
+        except BaseException:
+            self._slots.release()
+            raise
+
+    def release(self):
+        self._slots.release()
+
+    def pause(self, seconds):
+        """Hold back every caller of this provider, e.g. for a Retry-After."""
+        with self._lock:
+            self._blocked_until.value = max(self._blocked_until.value, time.time() + seconds)
+
+    def __enter__(self):
+        self.acquire()
+        return self
+
+    def __exit__(self, *exc_info):
+        self.release()
+
+
+def process_resource(factory):
+    """Build a process-wide object once.
+
+    Streamlit re-executes this script into a fresh module on every rerun and
+    browser session, so under Streamlit the object is kept in
+    st.cache_resource; batch and benchmark runs import the module only once.
+    """
+    return st.cache_resource(factory)() if streamlit_runtime.exists() else factory()
+
+def create_provider_limiters():
+    return {
+        provider: ProviderLimiter(PROVIDER_RATE[provider], PROVIDER_CONCURRENCY[provider])
+        for provider in PROVIDER_CONCURRENCY
+    }
+
+provider_limiters = process_resource(create_provider_limiters)
+
+def share_provider_limiters(limiters):
+    """Use limiters created by a parent process (ProcessPoolExecutor initializer for batch workers)."""
+    provider_limiters.update(limiters)
+
+# Connection pool size and (connect, read) timeouts of the per-provider HTTP sessions
+HTTP_POOL_SIZE = int(os.getenv("HTTP_POOL_SIZE", "10"))
+HTTP_TIMEOUT = (float(os.getenv("HTTP_CONNECT_TIMEOUT", "10")), float(os.getenv("HTTP_READ_TIMEOUT", "120")))
+
+
+class ClientRegistry:
+    """Pooled HTTP sessions, shared by all worker threads of a process.
+
+    Keeping them around lets requests reuse open TCP/TLS connections instead of
+    paying a new handshake for every asset. Entries are rebuilt after a fork so
+    batch worker processes never share a socket with their parent.
+    """
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._pid = os.getpid()
+        self._sessions = {}
+
+    def _reset_after_fork(self):
+        if self._pid != os.getpid():
+            self._pid = os.getpid()
+            self._sessions = {}
+
+    def session(self, provider):
+        """requests.Session for provider with a connection pool as large as its concurrency limit."""
+        with self._lock:
+            self._reset_after_fork()
+            if provider not in self._sessions:
+                pool_size = max(HTTP_POOL_SIZE, PROVIDER_CONCURRENCY.get(provider, 1))
+                adapter = HTTPAdapter(pool_connections=pool_size, pool_maxsize=pool_size)
+                session = requests.Session()
+                session.mount("https://", adapter)
+                session.mount("http://", adapter)
+                self._sessions[provider] = session
+            return self._sessions[provider]
+
+
+# Like the limiters, one registry per process even though Streamlit re-executes this script on every rerun
+clients = process_resource(ClientRegistry)
+
+def use_openai_session(api_key):
+    """Point the OpenAI SDK at the key and the shared pooled session (otherwise it keeps one per thread)."""
+    openai.api_key = api_key
+    openai.requestssession = clients.session("openai")
+
+# PDFs with at least this many pages are extracted by several worker processes
+PDF_PARALLEL_MIN_PAGES = int(os.getenv("PDF_PARALLEL_MIN_PAGES", "16"))
+PDF_EXTRACT_WORKERS = int(os.getenv("PDF_EXTRACT_WORKERS", "0")) or os.cpu_count() or 1
+
+# PDF images smaller than PDF_IMAGE_MIN_SIZE pixels on their short side, or stretched beyond
+# PDF_IMAGE_MAX_ASPECT, are skipped; images within PDF_IMAGE_HASH_DISTANCE bits of an earlier one are near duplicates
+PDF_IMAGE_MIN_SIZE = int(os.getenv("PDF_IMAGE_MIN_SIZE", "200"))
+PDF_IMAGE_MAX_ASPECT = float(os.getenv("PDF_IMAGE_MAX_ASPECT", "3.0"))
+PDF_IMAGE_HASH_DISTANCE = int(os.getenv("PDF_IMAGE_HASH_DISTANCE", "6"))
+
+# Every on-disk cache lives under CACHE_DIR (ignored by git) unless its own *_CACHE_DIR is set
+CACHE_DIR = os.getenv("CACHE_DIR", "cache")
+
+TTS_CACHE_DIR = os.getenv("TTS_CACHE_DIR", os.path.join(CACHE_DIR, "tts"))
+TTS_CACHE_MAX_BYTES = int(os.getenv("TTS_CACHE_MAX_MB", "500")) * 1024 * 1024
+
+# Narration is synthesized in sentence chunks of up to TTS_CHUNK_MAX_CHARS characters, each retried
+# on its own, and stitched with a short crossfade. Waves takes at most WAVES_MAX_CHARS characters per
+# request for the model in use, so chunks are capped there and each one stays a single request.
+WAVES_MODEL = "lightning"
+WAVES_MAX_CHARS = {"lightning": 250, "lightning-large": 140, "lightning-v2": 140}
+TTS_CHUNK_MAX_CHARS = min(int(os.getenv("TTS_CHUNK_MAX_CHARS", "250")), WAVES_MAX_CHARS[WAVES_MODEL])
+TTS_CROSSFADE_SECONDS = 0.03
+SENTENCE_BOUNDARY = re.compile(r"(?<=[.!?\u0964\u0965])\s+")
+
+
+class DiskCache:
+    """Content-addressed file store with atomic writes and size-bounded LRU eviction."""
+
+    def __init__(self, directory, max_bytes, suffix):
+        self.directory = directory
+        self.max_bytes = max_bytes
+        self.suffix = suffix
+        self.hits = 0
+        self.misses = 0
+        self._lock = threading.Lock()
+
+    @staticmethod
+    def make_key(*parts):
+        """Hash the given JSON-serialisable parts into a cache key."""
+        payload = json.dumps(parts, sort_keys=True, ensure_ascii=False)
+        return hashlib.sha256(payload.encode("utf-8")).hexdigest()
+
+    def path_for(self, key):
+        return os.path.join(self.directory, f"{key}{self.suffix}")
+
+    def get(self, key, validate=None):
+        """Return the cached file path for key, or None on a miss.
+
+        validate, if given, is called with the path and can reject a stale entry.
+        """
+        path = self.path_for(key)
+        with self._lock:
+            if os.path.exists(path) and (validate is None or validate(path)):
+                self.hits += 1
+                os.utime(path)  # Mark as recently used for LRU eviction
+                return path
+            self.misses += 1
+            return None
+
+    def store(self, key, write_fn):
+        """Populate key by calling write_fn(tmp_path), then move it into place atomically."""
+        os.makedirs(self.directory, exist_ok=True)
+        path = self.path_for(key)
+        tmp_path = os.path.join(self.directory, f".{key}.{uuid.uuid4().hex}.tmp{self.suffix}")
+        try:
+            write_fn(tmp_path)
+            os.replace(tmp_path, path)
+        finally:
+            if os.path.exists(tmp_path):
+                os.remove(tmp_path)
+        self.evict()
+        return path
+
+    def store_bytes(self, key, data):
+        def write(tmp_path):
+            with open(tmp_path, "wb") as f:
+                f.write(data)
+        return self.store(key, write)
+
+    def evict(self):
+        """Delete least recently used entries until the cache fits in max_bytes."""
+        with self._lock:
+            if not os.path.isdir(self.directory):
+                return
+            entries = []
+            for name in os.listdir(self.directory):
+                if name.startswith(".") or not name.endswith(self.suffix):
+                    continue
+                path = os.path.join(self.directory, name)
+                try:
+                    stat = os.stat(path)
+                except FileNotFoundError:
+                    continue
+                entries.append((stat.st_mtime, stat.st_size, path))
+            total = sum(size for _, size, _ in entries)
+            for _, size, path in sorted(entries):
+                if total <= self.max_bytes:
+                    break
+                try:
+                    os.remove(path)
+                except FileNotFoundError:
+                    pass
+                total -= size
+
+    def stats(self):
+        return {"hits": self.hits, "misses": self.misses}
+
+
+IMAGE_CACHE_DIR = os.getenv("IMAGE_CACHE_DIR", os.path.join(CACHE_DIR, "images"))
+IMAGE_CACHE_MAX_BYTES = int(os.getenv("IMAGE_CACHE_MAX_MB", "1000")) * 1024 * 1024
+
+SLIDE_CACHE_DIR = os.getenv("SLIDE_CACHE_DIR", os.path.join(CACHE_DIR, "slides"))
+SLIDE_CACHE_MAX_BYTES = int(os.getenv("SLIDE_CACHE_MAX_MB", "1000")) * 1024 * 1024
+
+MUSIC_CACHE_DIR = os.getenv("MUSIC_CACHE_DIR", os.path.join(CACHE_DIR, "music"))
+MUSIC_CACHE_MAX_BYTES = int(os.getenv("MUSIC_CACHE_MAX_MB", "500")) * 1024 * 1024
+MUSIC_SAMPLE_RATE = 44100
+# Narration is resampled to MUSIC_SAMPLE_RATE with a Kaiser-windowed sinc of this many zero crossings per side
+RESAMPLE_ZERO_CROSSINGS = 16
+RESAMPLE_KAISER_BETA = 8.6
+
+# numpy dtype, zero offset and full scale for each PCM WAV sample width the native reader handles
+WAV_SAMPLE_TYPES = {1: ("u1", 128.0, 128.0), 2: ("<i2", 0.0, 32768.0), 4: ("<i4", 0.0, 2147483648.0)}
+
+# Music ducking: the bed drops to MUSIC_DUCK_GAIN of its volume while narration is speaking (1.0 disables it)
+MUSIC_DUCK_GAIN = float(os.getenv("MUSIC_DUCK_GAIN", "0.35"))
+DUCK_THRESHOLD = 0.02
+DUCK_WINDOW_SECONDS = 0.01
+DUCK_FADE_SECONDS = 0.3
+
+LLM_CACHE_DIR = os.getenv("LLM_CACHE_DIR", os.path.join(CACHE_DIR, "llm"))
+LLM_CACHE_MAX_BYTES = int(os.getenv("LLM_CACHE_MAX_MB", "50")) * 1024 * 1024
+LLM_CACHE_TTL_SECONDS = int(os.getenv("LLM_CACHE_TTL_HOURS", "168")) * 3600
+
+def create_disk_caches():
+    return {
+        "tts": DiskCache(TTS_CACHE_DIR, TTS_CACHE_MAX_BYTES, ".wav"),
+        "image": DiskCache(IMAGE_CACHE_DIR, IMAGE_CACHE_MAX_BYTES, ".png"),
+        "slide": DiskCache(SLIDE_CACHE_DIR, SLIDE_CACHE_MAX_BYTES, ".png"),
+        "music": DiskCache(MUSIC_CACHE_DIR, MUSIC_CACHE_MAX_BYTES, ".npy"),
+        "llm": DiskCache(LLM_CACHE_DIR, LLM_CACHE_MAX_BYTES, ".json"),
+    }
+
+# One set of caches per process, so their hit/miss counts add up across Streamlit reruns and sessions
+disk_caches = process_resource(create_disk_caches)
+tts_cache, image_cache, slide_cache, music_cache, llm_cache = (
+    disk_caches[name] for name in ("tts", "image", "slide", "music", "llm")
+)
+
+# Timing spans are appended to METRICS_LOG as JSON lines; counters and span totals are written to
+# METRICS_PROM_FILE in Prometheus text format (e.g. for node_exporter's textfile collector). "" disables either.
+METRICS_LOG = os.getenv("METRICS_LOG", os.path.join("metrics", "spans.jsonl"))
+METRICS_PROM_FILE = os.getenv("METRICS_PROM_FILE", os.path.join("metrics", "metrics.prom"))
+# Once METRICS_LOG reaches this size it is moved to METRICS_LOG.1 (replacing the previous one) and restarted;
+# batch worker processes share the log, so rotation and appends hold an flock on METRICS_LOG.lock
+METRICS_LOG_MAX_BYTES = int(float(os.getenv("METRICS_LOG_MAX_MB", "20")) * 1024 * 1024)
+METRICS_PREFIX = "indicvideogen_"
+
+
+class Metrics:
+    """Thread-safe timing spans and counters for one process."""
+
+    def __init__(self, log_path, max_log_bytes=0):
+        self.log_path = log_path
+        self.max_log_bytes = max_log_bytes
+        self._lock = threading.Lock()
+        self.reset()
+
+    def reset(self):
+        with self._lock:
+            self.counters = {}
+            self.spans = {}
+
+    @contextmanager
+    def span(self, name, **attributes):
+        """Time the block; the yielded dict can be filled with more attributes (sizes, counts) for the record."""
+        start, started_at = time.perf_counter(), time.time()
+        status, error = "ok", None
+        try:
+            yield attributes
+        except Exception as e:
+            status, error = "error", str(e)
+            raise
+        finally:
+            duration = time.perf_counter() - start
+            record = dict(attributes, span=name, start=started_at, duration=duration, status=status, pid=os.getpid())
+            if error:
+                record["error"] = error
+            with self._lock:
+                totals = self.spans.setdefault(name, {"count": 0, "errors": 0, "seconds": 0.0, "max_seconds": 0.0})
+                totals["count"] += 1
+                totals["errors"] += status == "error"
+                totals["seconds"] += duration
+                totals["max_seconds"] = max(totals["max_seconds"], duration)
+                if self.log_path:
+                    self._append_log(record)
+
+    def _append_log(self, record):
+        """Append one JSON line, first moving a log of max_log_bytes or more aside to <log>.1.
+
+        Other processes may write the same log, so the size check, the move and
+        the append happen under an exclusive lock on <log>.lock (where the
+        platform has fcntl); otherwise two of them could both rotate and one
+        would replace the freshly rotated log with a nearly empty one.
+        """
+        os.makedirs(os.path.dirname(os.path.abspath(self.log_path)), exist_ok=True)
+        with open(f"{self.log_path}.lock", "a") as lock_file:
+            if fcntl:
+                fcntl.flock(lock_file, fcntl.LOCK_EX)
+            try:
+                if self.max_log_bytes and os.path.getsize(self.log_path) >= self.max_log_bytes:
+                    os.replace(self.log_path, f"{self.log_path}.1")
+            except OSError:
+                pass
+            with open(self.log_path, "a", encoding="utf-8") as f:
+                f.write(json.dumps(record, ensure_ascii=False, default=str) + "\n")
+
+    def count(self, name, amount=1, **labels):
+        key = (name, tuple(sorted(labels.items())))
+        with self._lock:
+            self.counters[key] = self.counters.get(key, 0) + amount
+
+    def set(self, name, value, **labels):
+        with self._lock:
+            self.counters[(name, tuple(sorted(labels.items())))] = value
+
+    def snapshot(self):
+        """Plain-dict copy of the span totals and counters (for the UI and batch summaries)."""
+        with self._lock:
+            return {
+                "spans": {name: dict(totals) for name, totals in self.spans.items()},
+                "counters": [
+                    {"name": name, "labels": dict(labels), "value": value}
+                    for (name, labels), value in sorted(self.counters.items())
+                ],
+            }
+
+    def prometheus_text(self):
+        lines = []
+        with self._lock:
+            lines += [f"# TYPE {METRICS_PREFIX}span_seconds summary"]
+            for name, totals in sorted(self.spans.items()):
+                lines.append(f'{METRICS_PREFIX}span_seconds_count{{span="{name}"}} {totals["count"]}')
+                lines.append(f'{METRICS_PREFIX}span_seconds_sum{{span="{name}"}} {totals["seconds"]:.6f}')
+            lines += [f"# TYPE {METRICS_PREFIX}span_errors_total counter"]
+            lines += [
+                f'{METRICS_PREFIX}span_errors_total{{span="{name}"}} {totals["errors"]}'
+                for name, totals in sorted(self.spans.items())
+            ]
+            typed = set()
+            for (name, labels), value in sorted(self.counters.items()):
+                if name not in typed:
+                    typed.add(name)
+                    lines.append(f"# TYPE {METRICS_PREFIX}{name} counter")
+                label_text = ",".join(f'{key}="{value_}"' for key, value_ in labels)
+                lines.append(f"{METRICS_PREFIX}{name}{{{label_text}}} {value}" if label_text
+                             else f"{METRICS_PREFIX}{name} {value}")
+        return "\n".join(lines) + "\n"
+
+    def write_prometheus(self, path):
+        """Atomically replace path with the current metrics in Prometheus text format."""
+        os.makedirs(os.path.dirname(os.path.abspath(path)), exist_ok=True)
+        tmp_path = f"{path}.{os.getpid()}.tmp"
+        with open(tmp_path, "w", encoding="utf-8") as f:
+            f.write(self.prometheus_text())
+        os.replace(tmp_path, path)
+
+
+def create_metrics():
+    return Metrics(METRICS_LOG, METRICS_LOG_MAX_BYTES)
+
+# Process-wide like the caches: every rerun and browser session adds to the same counters, so the
+# Prometheus file holds running totals instead of whichever rerun exported last
+metrics = process_resource(create_metrics)
+
+def traced(name):
+    """Decorator that records every call of the function as a timing span."""
+    def decorator(fn):
+        @functools.wraps(fn)
+        def wrapper(*args, **kwargs):
+            with metrics.span(name):
+                return fn(*args, **kwargs)
+        return wrapper
+    return decorator
+
+def reset_metrics():
+    """Start a fresh set of spans, counters and cache hit counts (e.g. per batch job)."""
+    metrics.reset()
+    for cache in disk_caches.values():
+        cache.hits = cache.misses = 0
+
+def export_metrics(prom_path=None):
+    """Copy the cache hit/miss counts into the metrics and write the Prometheus file."""
+    for name, cache in disk_caches.items():
+        metrics.set("cache_hits_total", cache.hits, cache=name)
+        metrics.set("cache_misses_total", cache.misses, cache=name)
+    prom_path = METRICS_PROM_FILE if prom_path is None else prom_path
+    if prom_path:
+        metrics.write_prometheus(prom_path)
+    return metrics.snapshot()
+
+# PROFILE_RENDER=render runs the render under cProfile; "job" profiles the whole batch or benchmark job instead.
+# Either way <video>.render.json next to the video records frame counts and the per-frame encode cost.
+PROFILE_MODES = ("render", "job")
+PROFILE_RENDER = os.getenv("PROFILE_RENDER", "").strip().lower()
+PROFILE_TOP_FUNCTIONS = 30
+
+def get_profiling_mode(mode=None):
+    """Normalize a profiling switch to None, "render" or "job", defaulting to PROFILE_RENDER."""
+    mode = PROFILE_RENDER if mode is None else (mode or "")
+    mode = {"1": "render", "true": "render", "yes": "render", "0": "", "false": "", "no": "", "off": ""}.get(mode, mode)
+    if mode and mode not in PROFILE_MODES:
+        raise ValueError(f"Unknown profiling mode '{mode}'. Choose one of: {', '.join(PROFILE_MODES)}")
+    return mode or None
+
+def _resource_clock():
+    """Wall time, CPU time of this process and CPU time of its finished children (ffmpeg, workers)."""
+    times = os.times()
+    return time.perf_counter(), time.process_time(), times.children_user + times.children_system
+
+def _resource_usage(start):
+    wall, cpu, child_cpu = _resource_clock()
+    return {"wall": wall - start[0], "cpu": cpu - start[1], "child_cpu": child_cpu - start[2]}
+
+def _top_functions(profiler, limit=PROFILE_TOP_FUNCTIONS):
+    """The profiled functions with the highest cumulative time, as plain dicts."""
+    rows = sorted(pstats.Stats(profiler).stats.items(), key=lambda item: item[1][3], reverse=True)[:limit]
+    return [
+        {"function": pstats.func_std_string(func), "calls": calls, "tottime": round(tottime, 4),
+         "cumtime": round(cumtime, 4)}
+        for func, (_, calls, tottime, cumtime, _) in rows
+    ]
+
+@contextmanager
+def profiled(output_file, scope, enabled=True, use_profiler=True):
+    """Measure the block and save <video>.<scope>.json (and a cProfile <video>.<scope>.prof) next to the video.
+
+    The yielded dict can be filled with details (engine, frame counts) for the
+    JSON summary. cProfile only sees the calling thread, so time spent in
+    thread pools and ffmpeg shows up as waiting; the summary's child_cpu covers
+    the finished ffmpeg processes. Open the .prof with pstats or snakeviz.
+    """
+    details = {}
+    if not enabled:
+        yield details
+        return
+    profiler = cProfile.Profile() if use_profiler else None
+    start = _resource_clock()
+    if profiler:
+        profiler.enable()
+    try:
+        yield details
+    finally:
+        if profiler:
+            profiler.disable()
+        summary = dict(details, scope=scope, **_resource_usage(start))
+        base_path = os.path.splitext(output_file)[0] + f".{scope}"
+        os.makedirs(os.path.dirname(os.path.abspath(base_path)), exist_ok=True)
+        if profiler:
+            profiler.dump_stats(base_path + ".prof")
+            summary.update(profile_file=base_path + ".prof", top_functions=_top_functions(profiler))
+        with open(base_path + ".json", "w", encoding="utf-8") as f:
+            json.dump(summary, f, indent=2, ensure_ascii=False, default=str)
+        print(f"Profile summary written to {base_path}.json")
+
+IMAGE_STYLE_PREFIX = "Generate a visually appealing image in 3d cartoon style for: "
+DALLE_IMAGE_SIZE = "512x512"
+STABILITY_ASPECT_RATIO = "1:1"
+STABILITY_API_URL = os.getenv("STABILITY_API_URL", "https://api.stability.ai/v2beta/stable-image/generate/sd3")
+
+# Seconds each PDF image is shown in the opening and closing slideshows
+PDF_SLIDE_DURATION = 2
+
+# Each uploaded PDF gets its own folder (named by its SHA-256) for extracted images and the video
+APP_OUTPUT_DIR = os.getenv("APP_OUTPUT_DIR", "outputs")
+
+# Video renderer: "moviepy" composes frames in Python, "ffmpeg" renders the still images directly
+# and "ffmpeg-segments" renders each section in parallel before a stream-copy concat
+RENDER_ENGINES = ("moviepy", "ffmpeg", "ffmpeg-segments")
+RENDER_ENGINE = os.getenv("RENDER_ENGINE", "moviepy")
+
+# Output profiles set the canvas, frame rate and x264 preset for the whole render.
+# "source" keeps the old behaviour of sizing the video to the largest slide image.
+OUTPUT_PROFILES = {
+    "shorts": {"label": "YouTube Shorts (1080x1920, vertical)", "size": (1080, 1920), "fps": 30, "preset": "medium"},
+    "landscape": {"label": "Landscape (1920x1080)", "size": (1920, 1080), "fps": 30, "preset": "medium"},
+    "square": {"label": "Square (1080x1080)", "size": (1080, 1080), "fps": 30, "preset": "medium"},
+    "source": {"label": "Largest source image size", "size": None, "fps": 24, "preset": "medium"},
+}
+OUTPUT_PROFILE = os.getenv("OUTPUT_PROFILE", "shorts")
+
+# Ken Burns motion: slides alternately zoom in and out by this factor while drifting towards
+# one of the anchors (fractions of the free space left/top of the crop window). Off (1.0) by default:
+# moving frames cost x264 far more than still ones and rule out -tune stillimage.
+KEN_BURNS_ZOOM = float(os.getenv("KEN_BURNS_ZOOM", "1.0"))
+# Moving slides are pre-scaled this many times larger than the zoomed canvas, so the whole-pixel crop
+# steps of NumPy indexing and zoompan are sub-pixel steps in the output
+KEN_BURNS_OVERSAMPLE = int(os.getenv("KEN_BURNS_OVERSAMPLE", "2"))
+KEN_BURNS_ANCHORS = ((0.5, 0.5), (0.3, 0.35), (0.7, 0.65), (0.65, 0.3), (0.35, 0.7))
+
+def get_output_profile(name=None):
+    """Look up an output profile by name, defaulting to OUTPUT_PROFILE."""
+    name = name or OUTPUT_PROFILE
+    if name not in OUTPUT_PROFILES:
+        raise ValueError(f"Unknown output profile '{name}'. Choose one of: {', '.join(OUTPUT_PROFILES)}")
+    return dict(OUTPUT_PROFILES[name], name=name)
+
 def save_uploaded_file(uploaded_file):
     """Save uploaded file and return path."""
     with tempfile.NamedTemporaryFile(delete=False, suffix=os.path.splitext(uploaded_file.name)[1]) as tmp_file:
         tmp_file.write(uploaded_file.getvalue())
         return tmp_file.name
 
+def open_pdf(source):
+    """Open a PDF from a file path, or from the bytes of an upload or file object, without re-reading it."""
+    if isinstance(source, (str, os.PathLike)):
+        return fitz.open(source)
+    data = source.getvalue() if hasattr(source, "getvalue") else source.read()
+    return fitz.open(stream=data, filetype="pdf")
+
+def _keep_pdf_image(width, height):
+    """Drop icons, logos and thin strips: images below the minimum size or outside the aspect limit."""
+    if min(width, height) < PDF_IMAGE_MIN_SIZE:
+        return False
+    return max(width, height) / min(width, height) <= PDF_IMAGE_MAX_ASPECT
+
+def image_dhash(image):
+    """64-bit difference hash of a PIL image as a boolean array, robust to rescaling and recompression."""
+    thumb = np.asarray(image.convert("L").resize((9, 8), Image.LANCZOS), dtype=np.int16)
+    return thumb[:, 1:] > thumb[:, :-1]
+
+def _write_page_images(pdf_document, page, page_number, output_dir, seen_xrefs):
+    """Write the page's images that pass the size filter and were not already written for another page."""
+    entries = []
+    for img_index, img in enumerate(page.get_images(full=True)):
+        xref = img[0]
+        if xref in seen_xrefs:
+            continue
+        seen_xrefs.add(xref)
+        base_image = pdf_document.extract_image(xref)
+        if not base_image or not _keep_pdf_image(base_image["width"], base_image["height"]):
+            continue
+        image_bytes = base_image["image"]
+        image_ext = base_image["ext"]
+        try:
+            dhash = image_dhash(Image.open(io.BytesIO(image_bytes))).ravel().tolist()
+        except Exception:
+            dhash = None  # Formats Pillow cannot read are kept without near-duplicate checks
+
+        image_filename = os.path.join(output_dir, f"pdf_image_{page_number+1}_{img_index+1}.{image_ext}")
+        with open(image_filename, "wb") as image_file:
+            image_file.write(image_bytes)
+        entries.append({"path": image_filename, "xref": xref, "dhash": dhash})
+    return entries
+
+def _ingest_pages(pdf_document, start, stop, output_dir, extract_text, extract_images):
+    """Extract pages [start, stop) of an open document, timing each page."""
+    pages = []
+    seen_xrefs = set()
+    for page_number in range(start, stop):
+        page_start = time.perf_counter()
+        page = pdf_document.load_page(page_number)
+        pages.append({
+            "text": page.get_text() if extract_text else "",
+            "images": _write_page_images(pdf_document, page, page_number, output_dir, seen_xrefs) if extract_images else [],
+            "seconds": time.perf_counter() - page_start,
+        })
+    return pages
+
+def dedupe_pdf_images(entries, max_distance=None):
+    """Drop repeated xrefs and near-identical images, deleting their files; returns the kept paths in order.
+
+    Near duplicates are found with one vectorized pairwise Hamming distance over
+    the difference hashes.
+    """
+    max_distance = PDF_IMAGE_HASH_DISTANCE if max_distance is None else max_distance
+    unique = []
+    seen_xrefs = set()
+    for entry in entries:
+        if entry["xref"] in seen_xrefs:
+            os.remove(entry["path"])  # Repeated in another page-range shard
+            continue
+        seen_xrefs.add(entry["xref"])
+        unique.append(entry)
+
+    hashed = [i for i, entry in enumerate(unique) if entry["dhash"] is not None]
+    drop = set()
+    if len(hashed) > 1:
+        hashes = np.array([unique[i]["dhash"] for i in hashed], dtype=bool)
+        distances = (hashes[:, None, :] != hashes[None, :, :]).sum(axis=2)
+        kept = []
+        for row, index in enumerate(hashed):
+            if kept and distances[row, kept].min() <= max_distance:
+                drop.add(index)
+            else:
+                kept.append(row)
+
+    for index in drop:
+        os.remove(unique[index]["path"])
+    return [entry["path"] for i, entry in enumerate(unique) if i not in drop]
+
+def _ingest_page_range(pdf_path, start, stop, output_dir, extract_text, extract_images):
+    """Worker process entry point: extract a page range with its own document handle."""
+    pdf_document = fitz.open(pdf_path)
+    try:
+        return _ingest_pages(pdf_document, start, stop, output_dir, extract_text, extract_images)
+    finally:
+        pdf_document.close()
+
+def _ingest_pages_parallel(source, page_count, workers, output_dir, extract_text, extract_images):
+    """Shard the pages into contiguous ranges, extract them in worker processes and merge in page order."""
+    tmp_path = None
+    if isinstance(source, (str, os.PathLike)):
+        pdf_path = source
+    else:
+        # Workers need a path to open; write the upload to a temporary file once
+        data = source.getvalue() if hasattr(source, "getvalue") else source.read()
+        with tempfile.NamedTemporaryFile(delete=False, suffix=".pdf") as tmp_file:
+            tmp_file.write(data)
+            tmp_path = pdf_path = tmp_file.name
+    try:
+        bounds = [page_count * i // workers for i in range(workers + 1)]
+        with ProcessPoolExecutor(max_workers=workers) as executor:
+            shards = executor.map(
+                _ingest_page_range,
+                *zip(*[(pdf_path, start, stop, output_dir, extract_text, extract_images)
+                       for start, stop in zip(bounds, bounds[1:]) if stop > start])
+            )
+            return [page for shard in shards for page in shard]
+    finally:
+        if tmp_path:
+            os.remove(tmp_path)
+
+@traced("pdf_ingest")
+def ingest_pdf(source, output_dir=".", extract_text=True, extract_images=True, workers=None):
+    """Open the PDF once and collect page texts, images and metadata in a single walk over its pages.
+
+    PDFs with at least PDF_PARALLEL_MIN_PAGES pages are split into page ranges
+    that are extracted in up to workers (default PDF_EXTRACT_WORKERS) parallel
+    worker processes. Returns a dict with
+    page_texts, text (all pages joined), images (paths of the images written to
+    output_dir), metadata, page_count and page_timings (seconds per page).
+    """
+    pdf_document = open_pdf(source)
+    try:
+        page_count = pdf_document.page_count
+        metadata = dict(pdf_document.metadata or {})
+        workers = min(workers or PDF_EXTRACT_WORKERS, page_count)
+        pages = None
+        if page_count >= PDF_PARALLEL_MIN_PAGES and workers > 1:
+            try:
+                pages = _ingest_pages_parallel(source, page_count, workers, output_dir, extract_text, extract_images)
+            except Exception as e:
+                print(f"Parallel PDF extraction failed ({e}); extracting pages sequentially.")
+        if pages is None:
+            pages = _ingest_pages(pdf_document, 0, page_count, output_dir, extract_text, extract_images)
+    finally:
+        pdf_document.close()
+
+    page_texts = [page["text"] for page in pages] if extract_text else []
+    ingest = {
+        "page_texts": page_texts,
+        "text": "".join(page_texts),
+        "images": dedupe_pdf_images([entry for page in pages for entry in page["images"]]),
+        "metadata": metadata,
+        "page_count": page_count,
+        "page_timings": [page["seconds"] for page in pages],
+    }
+    print("Extracted text from PDF:", ingest["text"][:500])  # Debug print for first 500 characters
+    return ingest
+
 def extract_text_from_pdf(pdf_file):
     """Extracts text from an uploaded PDF file."""
-    text = ""
-    pdf_document = fitz.open(stream=pdf_file.read(), filetype="pdf")
-    for page_num in range(len(pdf_document)):
-        page = pdf_document.load_page(page_num)
-        text += page.get_text()
-    print("Extracted text from PDF:", text[:500])  # Debug print for first 500 characters
-    return text
-
-def extract_images_from_pdf(pdf_file):
-    """Extract images from PDF and return their paths."""
-    pdf_document = fitz.open(pdf_file)
-    image_paths = []
-    
-    for page_number in range(len(pdf_document)):
-        page = pdf_document[page_number]
-        images = page.get_images(full=True)
-        
-        for img_index, img in enumerate(images):
-            xref = img[0]
-            base_image = pdf_document.extract_image(xref)
-            image_bytes = base_image["image"]
-            image_ext = base_image["ext"]
-            
-            image_filename = f"pdf_image_{page_number+1}_{img_index+1}.{image_ext}"
-            with open(image_filename, "wb") as image_file:
-                image_file.write(image_bytes)
-            image_paths.append(image_filename)
-    
-    pdf_document.close()
-    return image_paths
+    return ingest_pdf(pdf_file, extract_images=False)["text"]
 
-def synthesize_tts(api_key, text, voice_id="raman", speed=1.0, sample_rate=24000):
-    if not text.strip():
-        raise ValueError("Text cannot be empty for TTS synthesis.")
+def extract_main_temple_text(input_text):
+    """Keep only the text after the 'main temple' heading, if there is one."""
+    return input_text.lower().split('main temple')[1].strip() if 'main temple' in input_text.lower() else input_text.strip()
+
+def extract_images_from_pdf(pdf_file, output_dir="."):
+    """Extract images from PDF into output_dir and return their paths."""
+    return ingest_pdf(pdf_file, output_dir, extract_text=False)["images"]
+
+def split_long_sentence(sentence, max_chars):
+    """Break a sentence longer than max_chars at the last space before the limit."""
+    pieces = []
+    while len(sentence) > max_chars:
+        cut = sentence.rfind(" ", 0, max_chars + 1)
+        if cut <= 0:
+            cut = max_chars
+        pieces.append(sentence[:cut].strip())
+        sentence = sentence[cut:].strip()
+    return pieces + [sentence]
+
+def split_tts_chunks(text, max_chars=None):
+    """Split text at sentence boundaries into chunks of at most max_chars; longer sentences are split at spaces."""
+    max_chars = max_chars or TTS_CHUNK_MAX_CHARS
+    chunks = []
+    sentences = SENTENCE_BOUNDARY.split(text.strip())
+    for sentence in (piece for s in sentences for piece in split_long_sentence(s, max_chars)):
+        if chunks and len(chunks[-1]) + 1 + len(sentence) <= max_chars:
+            chunks[-1] += " " + sentence
+        elif sentence:
+            chunks.append(sentence)
+    return chunks
+
+def request_waves_speech(api_key, text, output_file, voice_id="raman", speed=1.0, sample_rate=24000):
+    """POST one chunk to the Waves get_speech endpoint over the pooled session and save it as a mono 16-bit WAV.
+
+    This is the request the SDK's WavesClient.synthesize makes, but the SDK goes
+    through the module-level requests.post and opens a new connection every time.
+    """
+    response = clients.session("smallest").post(
+        f"{waves_client.API_BASE_URL}/{WAVES_MODEL}/get_speech",
+        json={
+            "text": " ".join(text.split()),
+            "sample_rate": sample_rate,
+            "voice_id": voice_id,
+            "add_wav_header": False,
+            "speed": speed,
+        },
+        headers={
+            "Authorization": f"Bearer {api_key}",
+            "Content-Type": "application/json",
+        },
+        timeout=HTTP_TIMEOUT,
+    )
+    if response.status_code != 200:
+        raise requests.HTTPError(f"Failed to synthesize speech: {response.text}", response=response)
+    with wave.open(output_file, "wb") as wav_file:
+        wav_file.setnchannels(1)
+        wav_file.setsampwidth(2)
+        wav_file.setframerate(sample_rate)
+        wav_file.writeframes(response.content)
+
+def synthesize_tts_chunk(api_key, text, voice_id="raman", speed=1.0, sample_rate=24000):
+    """Synthesize one chunk to a cached WAV file, retrying just this chunk when a request fails."""
+    cache_key = DiskCache.make_key(text, voice_id, speed, sample_rate)
+    cached_path = tts_cache.get(cache_key)
+    if cached_path:
+        return cached_path
     try:
-        client = WavesClient(api_key=api_key)
-        output_dir = "audio_output"
-        if not os.path.exists(output_dir):
-            os.mkdir(output_dir)
-        output_file = f"audio_output/sync_synthesize_{voice_id}_{uuid.uuid4().hex}.wav"
-        client.synthesize(
-            text,
-            save_as=output_file,
-            voice_id=voice_id,
-            speed=speed,
-            sample_rate=sample_rate
-        )
-        return output_file
+        chunk_path = run_with_provider_limit("smallest", tts_cache.store, cache_key, lambda output_file: request_waves_speech(
+            api_key, text, output_file, voice_id=voice_id, speed=speed, sample_rate=sample_rate
+        ))
+        metrics.count("bytes_downloaded_total", os.path.getsize(chunk_path), provider="smallest")
+        return chunk_path
     except Exception as e:
-        if "Rate Limited" in str(e):
+        if _is_rate_limited(e):
             raise ValueError("Rate limited by TTS API. Please wait and retry.")
         raise ValueError(f"TTS Synthesis failed: {e}")
 
+def stitch_tts_chunks(chunk_paths, output_file, crossfade=TTS_CROSSFADE_SECONDS):
+    """Join chunk WAVs into one WAV, overlapping neighbouring chunks with a short linear crossfade."""
+    wavs = [_read_wav(path) for path in chunk_paths]
+    if not all(wavs):
+        raise ValueError("TTS chunks must be PCM WAV files to be stitched.")
+    sample_rate = wavs[0][0]
+    pieces = [wavs[0][2]]
+    for _, _, chunk in wavs[1:]:
+        previous = pieces.pop()
+        overlap = min(int(sample_rate * crossfade), len(previous), len(chunk))
+        fade_in = np.linspace(0.0, 1.0, overlap, dtype=np.float32)[:, None]
+        blended = previous[len(previous) - overlap:] * (1 - fade_in) + chunk[:overlap] * fade_in
+        pieces += [previous[:len(previous) - overlap], blended, chunk[overlap:]]
+    write_wav(output_file, np.concatenate(pieces), sample_rate)
+
+@traced("tts_section")
+def synthesize_tts(api_key, text, voice_id="raman", speed=1.0, sample_rate=24000, on_chunk=None):
+    """Synthesize text to a WAV file in parallel sentence chunks, reusing cached audio for identical requests.
+
+    on_chunk(index, path) is called for each chunk once every chunk before it
+    is ready, so the start of the narration can be played before the rest.
+    """
+    if not text.strip():
+        raise ValueError("Text cannot be empty for TTS synthesis.")
+    chunks = split_tts_chunks(text)
+    if len(chunks) == 1:
+        chunk_path = synthesize_tts_chunk(api_key, chunks[0], voice_id, speed, sample_rate)
+        if on_chunk:
+            on_chunk(0, chunk_path)
+        return chunk_path
+
+    cache_key = DiskCache.make_key(chunks, voice_id, speed, sample_rate, TTS_CROSSFADE_SECONDS)
+    cached_path = tts_cache.get(cache_key)
+    if cached_path:
+        return cached_path
+    chunk_paths = [None] * len(chunks)
+    next_chunk = 0
+    # Finished chunks stay cached when a sibling fails, so a retry of the section only redoes the failed ones
+    with ThreadPoolExecutor(max_workers=min(len(chunks), max(1, PROVIDER_CONCURRENCY["smallest"]))) as executor:
+        futures = {
+            executor.submit(synthesize_tts_chunk, api_key, chunk, voice_id, speed, sample_rate): index
+            for index, chunk in enumerate(chunks)
+        }
+        for future in as_completed(futures):
+            chunk_paths[futures[future]] = future.result()
+            while next_chunk < len(chunks) and chunk_paths[next_chunk]:
+                if on_chunk:
+                    on_chunk(next_chunk, chunk_paths[next_chunk])
+                next_chunk += 1
+    return tts_cache.store(cache_key, lambda output_file: stitch_tts_chunks(chunk_paths, output_file))
+
+def _load_llm_cache_entry(path):
+    with open(path, encoding="utf-8") as f:
+        return json.load(f)
+
+def _is_fresh_llm_cache_entry(path):
+    try:
+        return time.time() - _load_llm_cache_entry(path)["created_at"] < LLM_CACHE_TTL_SECONDS
+    except (OSError, ValueError, KeyError):
+        return False
+
+def cached_chat_completion(model, messages, max_tokens, temperature):
+    """Call openai.ChatCompletion.create, reusing a persisted response until it expires."""
+    cache_key = DiskCache.make_key(model, messages, temperature, max_tokens)
+    cached_path = llm_cache.get(cache_key, validate=_is_fresh_llm_cache_entry)
+    if cached_path:
+        return _load_llm_cache_entry(cached_path)["response"]
+
+    response = run_with_provider_limit(
+        "openai",
+        openai.ChatCompletion.create,
+        model=model,
+        messages=messages,
+        max_tokens=max_tokens,
+        temperature=temperature,
+        request_timeout=HTTP_TIMEOUT
+    )
+    entry = {"created_at": time.time(), "response": response.to_dict_recursive()}
+    llm_cache.store_bytes(cache_key, json.dumps(entry, ensure_ascii=False).encode("utf-8"))
+    return entry["response"]
+
+@traced("script_generation")
 def generate_full_script(api_key, text):
     """Generate a full script without labels, titles, or extraneous markers."""
-    openai.api_key = api_key
+    use_openai_session(api_key)
 
     # prompt = (
     #     "Write a detailed, professional script for a YouTube video about a temple. "
@@ -113,7 +956,7 @@ def generate_full_script(api_key, text):
         #     temperature=0.7
         # )
 
-        response = openai.ChatCompletion.create(
+        response = cached_chat_completion(
             model="gpt-3.5-turbo",
             messages=[
                 {
@@ -145,6 +988,7 @@ def generate_full_script(api_key, text):
     except Exception as e:
         raise ValueError(f"Error generating full script: {e}")
 
+@traced("section_split")
 def split_script_into_sections(full_script):
     """Split the full script into five sections based on paragraph position."""
     sections = {
@@ -202,8 +1046,7 @@ def get_section_specific_prompt(section_title, text):
 
 def generate_image_for_text(api_key, text,section_title):
     """Generate a visually appealing image in 3d cartoon style using OpenAI's DALL-E API based on the provided text."""
-    openai.api_key = api_key
-    retries = 3
+    use_openai_session(api_key)
     short_prompt = text[:1000]  # Ensure the prompt length is within the limit
     # Enhanced prompt for better visuals
     #enhanced_prompt1 = (
@@ -215,26 +1058,44 @@ def generate_image_for_text(api_key, text,section_title):
 
     enhanced_prompt = get_section_specific_prompt(section_title, text)
 
-    for attempt in range(retries):
-        try:
-            response = openai.Image.create(
-                prompt="Generate a visually appealing image in 3d cartoon style for: " + enhanced_prompt,
-                n=1,
-                size="512x512"
-            )
-            if "data" in response and len(response["data"]) > 0:
-                return response["data"][0]["url"]
-            else:
-                raise ValueError("Invalid response from DALL-E API.")
-        except Exception as e:
-            if attempt < retries - 1:
-                time.sleep(2)  # Wait before retrying
-            else:
-                raise ValueError(f"Image generation failed after {retries} attempts: {e}")
+    try:
+        response = run_with_provider_limit(
+            "dalle",
+            openai.Image.create,
+            prompt=IMAGE_STYLE_PREFIX + enhanced_prompt,
+            n=1,
+            size=DALLE_IMAGE_SIZE,
+            request_timeout=HTTP_TIMEOUT
+        )
+    except Exception as e:
+        raise ValueError(f"Image generation failed: {e}")
+    if "data" in response and len(response["data"]) > 0:
+        return response["data"][0]["url"]
+    raise ValueError("Invalid response from DALL-E API.")
+
+def generate_image_dalle(api_key, text, section_title, force_regenerate=False):
+    """Generate a DALL-E image for the section and return the path of the cached PNG."""
+    enhanced_prompt = get_section_specific_prompt(section_title, text)
+    cache_key = DiskCache.make_key("dalle", enhanced_prompt, DALLE_IMAGE_SIZE, IMAGE_STYLE_PREFIX)
+    if not force_regenerate:
+        cached_path = image_cache.get(cache_key)
+        if cached_path:
+            return cached_path
+
+    image_url = generate_image_for_text(api_key, text, section_title)
 
-def generate_image_stability(api_key, text, section_title):
-    """Generate image using Stability AI API."""
-    retries = 2
+    def download_image():
+        with metrics.span("image_download", provider="dalle") as span:
+            response = clients.session("dalle").get(image_url, timeout=HTTP_TIMEOUT)
+            response.raise_for_status()
+            span["bytes"] = len(response.content)
+        metrics.count("bytes_downloaded_total", len(response.content), provider="dalle")
+        return response.content
+
+    return image_cache.store_bytes(cache_key, run_with_provider_limit("dalle", download_image))
+
+def generate_image_stability(api_key, text, section_title, force_regenerate=False):
+    """Generate image using Stability AI API, reusing the cached PNG for a repeated prompt."""
     #enhanced_prompt = (
     #    f"Create a highly detailed, professional photograph of a Hindu temple scene: {text}. "
     #    "Include intricate architecture, ornate carvings, dramatic lighting, "
@@ -242,116 +1103,782 @@ def generate_image_stability(api_key, text, section_title):
     #)
 
     enhanced_prompt = get_section_specific_prompt(section_title, text)
+    cache_key = DiskCache.make_key("stability", enhanced_prompt, STABILITY_ASPECT_RATIO, IMAGE_STYLE_PREFIX)
+    if not force_regenerate:
+        cached_path = image_cache.get(cache_key)
+        if cached_path:
+            return cached_path
 
-       
-    for attempt in range(retries):
+    def request_image():
+        response = clients.session("stability").post(
+            STABILITY_API_URL,
+            headers={
+                "authorization": f"Bearer {api_key}",
+                "accept": "image/*"
+            },
+            files={"none": ''},
+            data={
+                "prompt": IMAGE_STYLE_PREFIX + enhanced_prompt,
+                "aspect_ratio": STABILITY_ASPECT_RATIO,
+                "output_format": "png",
+            },
+            timeout=HTTP_TIMEOUT,
+        )
+        if response.status_code != 200:
+            raise requests.HTTPError(f"Failed to generate image: {response.text}", response=response)
+        metrics.count("bytes_downloaded_total", len(response.content), provider="stability")
+        return response.content
+
+    try:
+        return image_cache.store_bytes(cache_key, run_with_provider_limit("stability", request_image))
+    except Exception as e:
+        raise ValueError(f"Image generation failed: {e}")
+
+def _error_status(error):
+    response = getattr(error, "response", None)
+    return getattr(response, "status_code", None) or getattr(error, "http_status", None)
+
+def _retry_after_seconds(error):
+    """Seconds from the Retry-After header of a failed HTTP or OpenAI request, if it sent one."""
+    response = getattr(error, "response", None)
+    headers = getattr(response, "headers", None) or getattr(error, "headers", None) or {}
+    try:
+        return max(0.0, float(headers.get("Retry-After")))
+    except (TypeError, ValueError):
+        return None
+
+def _is_rate_limited(error):
+    return _error_status(error) == 429 or isinstance(error, openai.error.RateLimitError) or "rate limit" in str(error).lower()
+
+def _is_retryable(error):
+    """Rate limits, timeouts, connection errors and 5xx responses are worth retrying; other errors are not."""
+    status = _error_status(error)
+    if status is not None:
+        return status in (408, 409, 429) or status >= 500
+    return _is_rate_limited(error) or isinstance(error, (
+        requests.ConnectionError, requests.Timeout,
+        openai.error.APIConnectionError, openai.error.Timeout, openai.error.TryAgain,
+        openai.error.ServiceUnavailableError,
+    ))
+
+def run_with_provider_limit(provider, fn, *args, **kwargs):
+    """Call fn under the provider's shared rate limit, retrying transient failures with backoff.
+
+    A Retry-After from the provider, or any rate-limit error, pauses every
+    caller of that provider; otherwise waits grow exponentially with full jitter.
+    """
+    limiter = provider_limiters[provider]
+    for attempt in range(PROVIDER_MAX_RETRIES + 1):
         try:
-            response = requests.post(
-                "https://api.stability.ai/v2beta/stable-image/generate/sd3",
-                headers={
-                    "authorization": f"Bearer {api_key}",
-                    "accept": "image/*"
-                },
-                files={"none": ''},
-                data={
-                    "prompt": "Generate a visually appealing image in 3d cartoon style for: " + enhanced_prompt,
-                    "output_format": "png",
-                },
+            with metrics.span(f"{provider}_request", attempt=attempt) as span:
+                wait_start = time.perf_counter()
+                with limiter:
+                    span["queued"] = time.perf_counter() - wait_start
+                    metrics.count("provider_requests_total", provider=provider)
+                    return fn(*args, **kwargs)
+        except Exception as e:
+            if attempt == PROVIDER_MAX_RETRIES or not _is_retryable(e):
+                metrics.count("provider_failures_total", provider=provider)
+                raise
+            metrics.count("provider_retries_total", provider=provider)
+            delay = _retry_after_seconds(e)
+            if delay is None:
+                delay = random.uniform(0, min(PROVIDER_BACKOFF_MAX, PROVIDER_BACKOFF_BASE * 2 ** attempt))
+            if _is_rate_limited(e) or _retry_after_seconds(e) is not None:
+                limiter.pause(delay)
+            print(f"{provider} request failed ({e}), retry {attempt + 1}/{PROVIDER_MAX_RETRIES} in {delay:.1f}s")
+            time.sleep(delay)
+
+@traced("section_image")
+def generate_section_image(image_service, stability_api_key, openai_api_key, script, section, force_regenerate=False):
+    """Generate the image for one section and return its local path."""
+    if image_service == 'Stability AI':
+        return generate_image_stability(stability_api_key, script, section, force_regenerate)
+    return generate_image_dalle(openai_api_key, script, section, force_regenerate)
+
+def generate_section_assets(sections_scripts, image_service, smallest_api_key, stability_api_key, openai_api_key,
+                            force_regenerate_images=False, on_audio_chunk=None):
+    """Generate audio and images for all sections concurrently.
+
+    Every TTS and image request is submitted up front (bounded per provider by
+    PROVIDER_CONCURRENCY), and results are yielded in section order as
+    (index, section, script, assets) where assets holds audio_path, image_path
+    and error. on_audio_chunk(index, section, chunk_index, chunk_path) is called
+    from the consuming thread as narration chunks become playable.
+    """
+    chunk_events = queue.Queue()
+
+    def report_chunks(i, section):
+        return lambda chunk_index, chunk_path: chunk_events.put((i, section, chunk_index, chunk_path))
+
+    def drain_chunk_events():
+        while not chunk_events.empty():
+            on_audio_chunk(*chunk_events.get())
+
+    max_workers = max(1, sum(PROVIDER_CONCURRENCY.values()))
+    with ThreadPoolExecutor(max_workers=max_workers) as executor:
+        pending = []
+        for i, (section, script) in enumerate(sections_scripts.items(), start=1):
+            if not script.strip():
+                pending.append((i, section, script, None, None))
+                continue
+            # TTS chunks take provider slots themselves, so the section call is not wrapped in one
+            audio_future = executor.submit(
+                synthesize_tts, smallest_api_key, script, on_chunk=report_chunks(i, section) if on_audio_chunk else None
+            )
+            image_future = executor.submit(
+                generate_section_image, image_service, stability_api_key, openai_api_key, script, section,
+                force_regenerate_images
             )
+            pending.append((i, section, script, audio_future, image_future))
 
-            if response.status_code == 200:
-                # Save image to file
-                image_path = f"generated_image_{uuid.uuid4()}.png"
-                with open(image_path, "wb") as f:
-                    f.write(response.content)
-                return image_path
-            else:
-                raise ValueError(f"Failed to generate image: {response.json()}")
-                
-        except Exception as e:
-            if attempt < retries - 1:
-                time.sleep(2)
+        for i, section, script, audio_future, image_future in pending:
+            assets = {"audio_path": None, "image_path": None, "error": None}
+            try:
+                if audio_future is None:
+                    raise ValueError(f"The script for {section} is empty. Skipping TTS synthesis.")
+                if on_audio_chunk:
+                    while not wait([audio_future], timeout=0.1).done:
+                        drain_chunk_events()
+                    drain_chunk_events()
+                assets["audio_path"] = audio_future.result()
+                assets["image_path"] = image_future.result()
+            except Exception as e:
+                assets["error"] = e
+            yield i, section, script, assets
+
+
+def _temp_audiofile_for(output_file):
+    """Keep MoviePy's temporary audio next to the output instead of the working directory."""
+    return f"{os.path.splitext(output_file)[0]}_TEMP_MPY_wvf_snd.mp3"
+
+def split_pdf_images(pdf_images):
+    """Split PDF images into the opening slideshow (first five) and the closing one (the rest)."""
+    return pdf_images[:5], pdf_images[5:]
+
+def load_music_pcm(music_path, sample_rate=MUSIC_SAMPLE_RATE):
+    """Return the track as a memory-mapped float32 (samples, 2) array, decoding it only on the first use."""
+    stat = os.stat(music_path)
+    cache_key = DiskCache.make_key(os.path.abspath(music_path), stat.st_size, stat.st_mtime, sample_rate)
+    cached_path = music_cache.get(cache_key)
+    if not cached_path:
+        def decode(tmp_path):
+            result = subprocess.run(
+                [get_setting("FFMPEG_BINARY"), "-loglevel", "error", "-i", music_path,
+                 "-f", "f32le", "-acodec", "pcm_f32le", "-ac", "2", "-ar", str(sample_rate), "-"],
+                stdout=subprocess.PIPE, stderr=subprocess.PIPE
+            )
+            if result.returncode != 0:
+                raise ValueError(f"Could not decode background music: {result.stderr.decode(errors='replace')}")
+            np.save(tmp_path, np.frombuffer(result.stdout, dtype=np.float32).reshape(-1, 2))
+        cached_path = music_cache.store(cache_key, decode)
+    return np.load(cached_path, mmap_mode="r")
+
+def build_music_bed(music_path, duration, volume=0.1, sample_rate=MUSIC_SAMPLE_RATE):
+    """Loop the cached track to duration seconds and scale it by volume, as one float32 (samples, 2) array."""
+    track = load_music_pcm(music_path, sample_rate)
+    if len(track) == 0:
+        raise ValueError(f"Background music {music_path} contains no audio.")
+    bed = np.empty((int(round(duration * sample_rate)), 2), dtype=np.float32)
+    for start in range(0, len(bed), len(track)):
+        chunk = bed[start:start + len(track)]
+        np.multiply(track[:len(chunk)], volume, out=chunk)
+    return bed
+
+def plan_timeline(images, audios, pdf_images=None, fps=24):
+    """Lay out the video as a list of slides: {"image", "duration", "frames", "audio"} in playback order.
+
+    Slide timing is snapped to whole frames at fps.
+    """
+    first_pdf_images, second_pdf_images = split_pdf_images(pdf_images or [])
+    slides = [(img, PDF_SLIDE_DURATION, None) for img in first_pdf_images]
+    slides += [(img, probe_audio_duration(audio), audio) for img, audio in zip(images, audios)]
+    slides += [(img, PDF_SLIDE_DURATION, None) for img in second_pdf_images]
+    return [
+        {"image": img, "duration": duration, "frames": max(1, int(round(duration * fps))), "audio": audio}
+        for img, duration, audio in slides
+    ]
+
+def timeline_duration(timeline, fps):
+    return sum(slide["frames"] for slide in timeline) / fps
+
+def get_canvas_size(image_paths):
+    """Return the largest width and height of the images, rounded up to even for yuv420p."""
+    widths, heights = zip(*(Image.open(path).size for path in image_paths))
+    return max(widths) + max(widths) % 2, max(heights) + max(heights) % 2
+
+def _read_wav(audio_path, header_only=False):
+    """Read a PCM WAV natively, returning (sample_rate, channels, samples) or None if it needs ffmpeg."""
+    if not audio_path.lower().endswith(".wav"):
+        return None
+    try:
+        with wave.open(audio_path, "rb") as wav_file:
+            sample_rate, channels, sample_width = wav_file.getframerate(), wav_file.getnchannels(), wav_file.getsampwidth()
+            if header_only:
+                return sample_rate, channels, wav_file.getnframes()
+            if sample_width not in WAV_SAMPLE_TYPES:
+                return None
+            frames = wav_file.readframes(wav_file.getnframes())
+    except (wave.Error, EOFError):
+        return None
+    dtype, offset, scale = WAV_SAMPLE_TYPES[sample_width]
+    samples = (np.frombuffer(frames, dtype=dtype).astype(np.float32) - offset) / scale
+    return sample_rate, channels, samples.reshape(-1, channels)
+
+def probe_audio_duration(audio_path):
+    """Return the duration of an audio file in seconds, from the WAV header when possible."""
+    header = _read_wav(audio_path, header_only=True)
+    if header:
+        sample_rate, _, frame_count = header
+        return frame_count / sample_rate
+    audio_clip = AudioFileClip(audio_path)
+    duration = audio_clip.duration
+    audio_clip.close()
+    return duration
+
+def resampling_filter(up, down, zero_crossings=RESAMPLE_ZERO_CROSSINGS, beta=RESAMPLE_KAISER_BETA):
+    """Kaiser-windowed sinc low-pass for resampling by up/down, cut off at the lower of the two Nyquist rates."""
+    max_rate = max(up, down)
+    half_length = zero_crossings * max_rate
+    n = np.arange(-half_length, half_length + 1, dtype=np.float64)
+    return up / max_rate * np.sinc(n / max_rate) * np.kaiser(len(n), beta)
+
+def resample_pcm(pcm, source_rate, target_rate):
+    """Band-limited polyphase resampling of a (samples, channels) array, e.g. 24 kHz speech to 44.1 kHz.
+
+    Output sample m is the windowed-sinc filter evaluated around input
+    position m * source_rate / target_rate; only the filter phase at that
+    position is applied, one vectorized multiply-add per filter tap.
+    """
+    if source_rate == target_rate or len(pcm) == 0:
+        return pcm
+    divisor = math.gcd(source_rate, target_rate)
+    up, down = target_rate // divisor, source_rate // divisor
+    fir = resampling_filter(up, down)
+    half_length = len(fir) // 2
+    taps = (len(fir) - 1) // up + 1
+    # weights[tap, phase] is the filter coefficient fir[phase + tap * up]
+    weights = np.concatenate([fir, np.zeros(taps * up - len(fir))]).reshape(taps, up).astype(np.float32)
+    target_length = int(round(len(pcm) * target_rate / source_rate))
+    # Output m = row * up + column uses filter phase phases[column] and input samples up to newest[row, column];
+    # each row of outputs is down input samples later than the previous one
+    rows = -(-target_length // up)
+    first = np.arange(up, dtype=np.int64) * down + half_length
+    phases = first % up
+    newest = (first // up)[None, :] + (np.arange(rows, dtype=np.int64) * down)[:, None]
+    padded = np.concatenate([
+        np.zeros((taps, pcm.shape[1]), np.float32), pcm.astype(np.float32),
+        np.zeros((half_length // up + 2 * down + 2, pcm.shape[1]), np.float32),
+    ])
+    output = np.zeros((rows, up, pcm.shape[1]), np.float32)
+    for tap in range(taps):
+        output += weights[tap, phases][None, :, None] * padded[taps - tap:].take(newest, axis=0)
+    return output.reshape(-1, pcm.shape[1])[:target_length]
+
+def load_audio_pcm(audio_path, sample_rate=MUSIC_SAMPLE_RATE):
+    """Load an audio file as a float32 (samples, 2) array at sample_rate.
+
+    PCM WAV files (like the Smallest Waves narration) are read directly; other
+    formats are decoded with an ffmpeg subprocess.
+    """
+    wav = _read_wav(audio_path)
+    if wav:
+        source_rate, channels, samples = wav
+        # Resampling before the upmix filters mono narration once instead of per channel
+        samples = resample_pcm(samples[:, :2], source_rate, sample_rate)
+        if channels == 1:
+            # Same -3 dB pan law ffmpeg (and so MoviePy) applies when upmixing mono to stereo
+            samples = np.repeat(samples * np.float32(np.sqrt(0.5)), 2, axis=1)
+        return samples
+
+    result = subprocess.run(
+        [get_setting("FFMPEG_BINARY"), "-loglevel", "error", "-i", audio_path,
+         "-f", "f32le", "-acodec", "pcm_f32le", "-ac", "2", "-ar", str(sample_rate), "-"],
+        stdout=subprocess.PIPE, stderr=subprocess.PIPE
+    )
+    if result.returncode != 0:
+        raise ValueError(f"Could not decode {audio_path}: {result.stderr.decode(errors='replace')}")
+    return np.frombuffer(result.stdout, dtype=np.float32).reshape(-1, 2)
+
+def compute_ducking_gain(narration, sample_rate, duck_gain):
+    """Return a per-sample music gain that dips to duck_gain wherever the narration is speaking."""
+    block = max(1, int(sample_rate * DUCK_WINDOW_SECONDS))
+    block_count = -(-len(narration) // block)
+    mono = np.zeros(block_count * block, dtype=np.float32)
+    mono[:len(narration)] = narration.mean(axis=1)
+    rms = np.sqrt(np.mean(np.square(mono.reshape(block_count, block)), axis=1))
+    target = np.where(rms > DUCK_THRESHOLD, duck_gain, 1.0).astype(np.float32)
+    # A moving average turns the on/off decision into short fades instead of jumps
+    fade_blocks = max(1, int(DUCK_FADE_SECONDS / DUCK_WINDOW_SECONDS))
+    padded = np.pad(target, fade_blocks // 2, mode="edge")
+    smoothed = np.convolve(padded, np.full(fade_blocks, 1.0 / fade_blocks, dtype=np.float32), mode="valid")
+    return np.repeat(smoothed[:block_count], block)[:len(narration)]
+
+@traced("soundtrack_mix")
+def mix_soundtrack(timeline, background_music_path, fps, music_volume=0.1, duck_gain=None, sample_rate=MUSIC_SAMPLE_RATE):
+    """Mix the whole soundtrack in one vectorized pass.
+
+    Narration clips are placed at their slide offsets, the looped music bed is
+    ducked under speech and added, and the float32 (samples, 2) result is clipped
+    to [-1, 1].
+    """
+    duck_gain = MUSIC_DUCK_GAIN if duck_gain is None else duck_gain
+    total_samples = int(round(timeline_duration(timeline, fps) * sample_rate))
+    narration = np.zeros((total_samples, 2), dtype=np.float32)
+    frame_offset = 0
+    for slide in timeline:
+        if slide["audio"]:
+            start = int(round(frame_offset * sample_rate / fps))
+            pcm = load_audio_pcm(slide["audio"], sample_rate)[:max(0, total_samples - start)]
+            narration[start:start + len(pcm)] += pcm
+        frame_offset += slide["frames"]
+
+    soundtrack = build_music_bed(background_music_path, total_samples / sample_rate, music_volume, sample_rate)
+    if duck_gain < 1.0:
+        soundtrack *= compute_ducking_gain(narration, sample_rate, duck_gain)[:, None]
+    soundtrack += narration
+    return np.clip(soundtrack, -1.0, 1.0, out=soundtrack)
+
+def write_wav(path, pcm, sample_rate=MUSIC_SAMPLE_RATE):
+    """Write a float32 (samples, channels) array as a 16-bit PCM WAV file."""
+    with wave.open(path, "wb") as wav_file:
+        wav_file.setnchannels(pcm.shape[1])
+        wav_file.setsampwidth(2)
+        wav_file.setframerate(sample_rate)
+        wav_file.writeframes((pcm * 32767).astype("<i2").tobytes())
+
+def _letterbox_image(source_path, canvas_size, output_path):
+    """Fit the image inside canvas_size, keeping its aspect ratio, and centre it on a black canvas."""
+    with Image.open(source_path) as image:
+        image = image.convert("RGB")
+        fitted = ImageOps.contain(image, canvas_size, Image.LANCZOS)
+    canvas = Image.new("RGB", canvas_size, (0, 0, 0))
+    canvas.paste(fitted, ((canvas_size[0] - fitted.width) // 2, (canvas_size[1] - fitted.height) // 2))
+    canvas.save(output_path, format="PNG", compress_level=1)
+
+def normalize_slide_image(source_path, canvas_size):
+    """Return the path of the letterboxed copy of source_path at canvas_size, creating it on a cache miss."""
+    with open(source_path, "rb") as f:
+        source_hash = hashlib.sha256(f.read()).hexdigest()
+    cache_key = DiskCache.make_key(source_hash, list(canvas_size))
+    cached_path = slide_cache.get(cache_key)
+    if cached_path:
+        return cached_path
+    return slide_cache.store(cache_key, lambda tmp_path: _letterbox_image(source_path, canvas_size, tmp_path))
+
+@traced("slide_prescale")
+def normalize_timeline_images(timeline, canvas_size):
+    """Pre-scale every slide image to canvas_size in a worker pool so renderers only see frames of that size."""
+    unique_images = list(dict.fromkeys(slide["image"] for slide in timeline))
+    with ThreadPoolExecutor(max_workers=os.cpu_count() or 1) as executor:
+        normalized = dict(zip(
+            unique_images, executor.map(lambda path: normalize_slide_image(path, canvas_size), unique_images)
+        ))
+    return [dict(slide, image=normalized[slide["image"]]) for slide in timeline]
+
+def plan_slide_motion(timeline, zoom):
+    """Give each slide a Ken Burns move, alternating zoom in and zoom out and cycling through the pan anchors."""
+    if zoom <= 1.0:
+        return [dict(slide, motion=None) for slide in timeline]
+    return [
+        dict(slide, motion={
+            "zoom": (1.0, zoom) if i % 2 == 0 else (zoom, 1.0),
+            "anchor": KEN_BURNS_ANCHORS[i % len(KEN_BURNS_ANCHORS)],
+        })
+        for i, slide in enumerate(timeline)
+    ]
+
+def ken_burns_windows(slide, source_size):
+    """Crop window (x, y, width, height) in source pixels for every frame of a moving slide."""
+    (zoom_start, zoom_end), (anchor_x, anchor_y) = slide["motion"]["zoom"], slide["motion"]["anchor"]
+    progress = np.arange(slide["frames"]) / max(1, slide["frames"] - 1)
+    zoom = zoom_start + (zoom_end - zoom_start) * progress
+    widths = source_size[0] / zoom
+    heights = source_size[1] / zoom
+    return np.stack([
+        (source_size[0] - widths) * anchor_x, (source_size[1] - heights) * anchor_y, widths, heights
+    ], axis=1)
+
+@functools.lru_cache(maxsize=2)
+def _slide_pixels(image_path):
+    """Decoded RGB pixels of a pre-scaled slide; slides render in order, so two entries cover each cut."""
+    with Image.open(image_path) as image:
+        return np.asarray(image.convert("RGB"))
+
+def ken_burns_clip(slide, canvas_size, fps):
+    """MoviePy clip that cuts each frame out of the oversampled pre-scaled slide by integer indexing.
+
+    Row and column indices of every frame are computed once up front, so a
+    frame is just two NumPy takes from the decoded source, with no per-frame
+    resize.
+    """
+    with Image.open(slide["image"]) as image:
+        source_size = image.size
+    windows = ken_burns_windows(slide, source_size)
+    col_steps = (np.arange(canvas_size[0]) + 0.5) / canvas_size[0]
+    row_steps = (np.arange(canvas_size[1]) + 0.5) / canvas_size[1]
+    rows = (windows[:, 1:2] + windows[:, 3:4] * row_steps).astype(np.int32)
+    cols = (windows[:, 0:1] + windows[:, 2:3] * col_steps).astype(np.int32)
+
+    def make_frame(t):
+        frame = min(int(t * fps + 0.5), len(windows) - 1)
+        return _slide_pixels(slide["image"]).take(rows[frame], axis=0).take(cols[frame], axis=1)
+
+    return VideoClip(make_frame, duration=slide["frames"] / fps)
+
+def create_video_with_audio(images, audios, background_music_path, pdf_images=None, output_file="final_video.mp4",
+                            music_volume=0.1, render_engine=None, output_profile=None, ken_burns_zoom=None,
+                            profiling=None):
+    """Create final video with PDF images at start and end using the selected render engine.
+
+    The output profile fixes the canvas, frame rate and encoder preset. Every
+    slide is letterboxed once before rendering: to the canvas for still slides,
+    or to the canvas enlarged by the Ken Burns zoom and KEN_BURNS_OVERSAMPLE so
+    moving slides are only ever cropped and downscaled. With profiling enabled (see PROFILE_RENDER)
+    the phase timings and per-frame encode cost go to <video>.render.json.
+    """
+    render_engine = render_engine or RENDER_ENGINE
+    if render_engine not in RENDER_ENGINES:
+        raise ValueError(f"Unknown render engine '{render_engine}'. Choose one of: {', '.join(RENDER_ENGINES)}")
+    zoom = KEN_BURNS_ZOOM if ken_burns_zoom is None else ken_burns_zoom
+    profile = get_output_profile(output_profile)
+    profiling = get_profiling_mode(profiling)
+    # In job mode the caller's profiler is already running and cProfile cannot nest
+    with metrics.span("render", engine=render_engine, profile=profile["name"]) as span, \
+            profiled(output_file, "render", enabled=bool(profiling), use_profiler=profiling == "render") as details:
+        phase = _resource_clock()
+        timeline = plan_timeline(images, audios, pdf_images, profile["fps"])
+        canvas_size = tuple(profile["size"] or get_canvas_size([slide["image"] for slide in timeline]))
+        profile["size"] = canvas_size
+        timeline = plan_slide_motion(timeline, zoom)
+        scale = zoom * max(1, KEN_BURNS_OVERSAMPLE) if zoom > 1.0 else 1.0
+        source_size = (int(round(canvas_size[0] * scale)), int(round(canvas_size[1] * scale)))
+        timeline = normalize_timeline_images(timeline, source_size)
+        span.update(slides=len(timeline), frames=sum(slide["frames"] for slide in timeline))
+        details.update(engine=render_engine, profile=profile["name"], size=canvas_size, fps=profile["fps"],
+                       ken_burns_zoom=zoom, slides=span["slides"], moving_slides=sum(bool(s["motion"]) for s in timeline),
+                       frames=span["frames"], video_seconds=span["frames"] / profile["fps"],
+                       prescale=_resource_usage(phase))
+        phase = _resource_clock()
+        soundtrack = mix_soundtrack(timeline, background_music_path, profile["fps"], music_volume)
+        details["soundtrack"] = _resource_usage(phase)
+        phase = _resource_clock()
+        with metrics.span("video_encode", engine=render_engine, frames=span["frames"]):
+            if render_engine == "ffmpeg":
+                output = render_with_ffmpeg(timeline, soundtrack, profile, output_file)
+            elif render_engine == "ffmpeg-segments":
+                output = render_with_ffmpeg_segments(timeline, soundtrack, profile, output_file)
             else:
-                raise ValueError(f"Image generation failed after {retries} attempts: {e}")
+                output = render_with_moviepy(timeline, soundtrack, profile, output_file)
+        encode = details["encode"] = _resource_usage(phase)
+        frames = max(span["frames"], 1)
+        details.update(
+            encode_ms_per_frame=1000 * encode["wall"] / frames,
+            encode_cpu_ms_per_frame=1000 * (encode["cpu"] + encode["child_cpu"]) / frames,
+            realtime_factor=details["video_seconds"] / encode["wall"] if encode["wall"] else None,
+        )
+        span.update(encode_ms_per_frame=details["encode_ms_per_frame"])
+        return output
 
+def render_with_moviepy(timeline, soundtrack, profile, output_file="final_video.mp4"):
+    """Render the video by chaining MoviePy clips of the pre-scaled slides."""
+    video_clips = [
+        ken_burns_clip(slide, profile["size"], profile["fps"]) if slide["motion"]
+        else ImageClip(slide["image"]).set_duration(slide["frames"] / profile["fps"])
+        for slide in timeline
+    ]
+    # All slides share the canvas size, so no per-frame compositing is needed
+    final_video = concatenate_videoclips(video_clips, method="chain")
+    final_video = final_video.set_audio(AudioArrayClip(soundtrack, fps=MUSIC_SAMPLE_RATE))
+    final_video.write_videofile(output_file, fps=profile["fps"], codec="libx264", preset=profile["preset"],
+                                temp_audiofile=_temp_audiofile_for(output_file))
+    return output_file
 
-def create_pdf_images_videos(pdf_images):
-    """Create two videos from PDF images, handling any number of images."""
-    if not pdf_images:
-        return None, None
-    
-    # Handle different image count scenarios
-    total_images = len(pdf_images)
-    if total_images <= 5:
-        # If 5 or fewer images, create only first video
-        first_images = pdf_images
-        remaining_images = []
-    else:
-        # If more than 5 images, split into two groups
-        first_images = pdf_images[:5]
-        remaining_images = pdf_images[5:]
-    
-    # Create first video if there are any images
-    first_video = None
-    if first_images:
-        clips = [ImageClip(img).set_duration(2) for img in first_images]
-        first_video = concatenate_videoclips(clips, method="compose")
-        first_video.write_videofile("pdf_images_first.mp4", fps=24, codec="libx264")
-        first_video = "pdf_images_first.mp4"
-    
-    # Create second video only if there are remaining images
-    second_video = None
-    if remaining_images:
-        clips = [ImageClip(img).set_duration(2) for img in remaining_images]
-        second_video = concatenate_videoclips(clips, method="compose")
-        second_video.write_videofile("pdf_images_second.mp4", fps=24, codec="libx264")
-        second_video = "pdf_images_second.mp4"
-    
-    return first_video, second_video        
+def _ken_burns_filter(slide, canvas_size, fps):
+    """zoompan filter producing the same crop windows as ken_burns_windows from a single decoded still."""
+    (zoom_start, zoom_end), (anchor_x, anchor_y) = slide["motion"]["zoom"], slide["motion"]["anchor"]
+    span = max(1, slide["frames"] - 1)
+    return (
+        f"zoompan=z='{zoom_start}+({zoom_end - zoom_start})*on/{span}'"
+        f":x='(iw-iw/zoom)*{anchor_x}':y='(ih-ih/zoom)*{anchor_y}'"
+        f":d={slide['frames']}:s={canvas_size[0]}x{canvas_size[1]}:fps={fps}"
+    )
 
+def _ffmpeg_video_graph(timeline, profile):
+    """Return (input args, filters) that render the slides into the [vout] stream."""
+    args = []
+    filters = []
+    video_labels = []
+    fps = profile["fps"]
+    for i, slide in enumerate(timeline):
+        # Each pre-scaled still is decoded once and either repeated or panned in the filter graph
+        args += ["-i", slide["image"]]
+        if slide["motion"]:
+            frames = _ken_burns_filter(slide, profile["size"], fps)
+        else:
+            frames = f"loop=loop=-1:size=1:start=0,trim=end_frame={slide['frames']}"
+        filters.append(f"[{i}:v]format=yuv420p,{frames},setsar=1,settb=1/{fps},setpts=N[v{i}]")
+        video_labels.append(f"[v{i}]")
+    filters.append(f"{''.join(video_labels)}concat=n={len(timeline)}:v=1:a=0[vout]")
+    return args, filters
 
-def create_video_with_audio(images, audios, background_music_path, pdf_images=None, output_file="final_video.mp4", music_volume=0.1):
-    """Create final video with PDF images at start and end."""
-    video_clips = []
-    
-    # Create PDF videos and add first one
-    if pdf_images:
-        first_pdf_video, second_pdf_video = create_pdf_images_videos(pdf_images)
-        if first_pdf_video:
-            video_clips.append(VideoFileClip(first_pdf_video))
-    
-    # Add main content
-    for img, audio in zip(images, audios):
-        audio_clip = AudioFileClip(audio)
-        image_clip = ImageClip(img).set_duration(audio_clip.duration).set_audio(audio_clip)
-        video_clips.append(image_clip)
-    
-    # Add second PDF video if exists
-    if pdf_images and second_pdf_video:
-        video_clips.append(VideoFileClip(second_pdf_video))
+def _x264_args(profile, still=True, threads=None):
+    """Encoder settings shared by every ffmpeg render so segments can be joined without re-encoding."""
+    args = ["-r", str(profile["fps"]), "-c:v", "libx264", "-preset", profile["preset"], "-pix_fmt", "yuv420p"]
+    if still:
+        args += ["-tune", "stillimage"]
+    if threads:
+        args += ["-threads", str(threads)]
+    return args
 
-    final_video = concatenate_videoclips(video_clips, method="compose")
-    
-    # Add background music
-    background_music = AudioFileClip(background_music_path)
-    total_duration = final_video.duration
-    
-    looped_music = CompositeAudioClip([
-        background_music.volumex(music_volume).set_start(i * background_music.duration)
-        for i in range(int(total_duration // background_music.duration) + 1)
-    ]).subclip(0, total_duration)
+def _audio_output_args(timeline, fps):
+    return ["-c:a", "aac", "-b:a", "192k", "-t", f"{timeline_duration(timeline, fps):.3f}", "-movflags", "+faststart"]
 
-    final_video = final_video.set_audio(CompositeAudioClip([final_video.audio, looped_music]))
-    final_video.write_videofile(output_file, fps=24, codec="libx264")
-    
-    # Cleanup temporary files
-    if first_pdf_video and os.path.exists(first_pdf_video):
-        os.remove(first_pdf_video)
-    if second_pdf_video and os.path.exists(second_pdf_video):
-        os.remove(second_pdf_video)
-    
+def _run_ffmpeg(cmd):
+    result = subprocess.run(cmd, stdout=subprocess.DEVNULL, stderr=subprocess.PIPE, text=True)
+    if result.returncode != 0:
+        raise ValueError(f"ffmpeg render failed: {result.stderr.strip()[-2000:]}")
+
+def build_ffmpeg_command(timeline, soundtrack_path, profile, output_file):
+    """Build one ffmpeg command that renders the timeline of still images over the mixed soundtrack."""
+    video_args, video_filters = _ffmpeg_video_graph(timeline, profile)
+    still = not any(slide["motion"] for slide in timeline)
+    return (
+        [get_setting("FFMPEG_BINARY"), "-y", "-loglevel", "error"] + video_args + ["-i", soundtrack_path]
+        + ["-filter_complex", ";".join(video_filters), "-map", "[vout]", "-map", f"{len(timeline)}:a"]
+        + _x264_args(profile, still) + _audio_output_args(timeline, profile["fps"]) + [output_file]
+    )
+
+def render_with_ffmpeg(timeline, soundtrack, profile, output_file="final_video.mp4"):
+    """Render the timeline with a single ffmpeg process instead of MoviePy's per-frame compositing."""
+    with tempfile.TemporaryDirectory(dir=os.path.dirname(os.path.abspath(output_file))) as work_dir:
+        soundtrack_path = os.path.join(work_dir, "soundtrack.wav")
+        write_wav(soundtrack_path, soundtrack)
+        _run_ffmpeg(build_ffmpeg_command(timeline, soundtrack_path, profile, output_file))
     return output_file
 
+def split_timeline_segments(timeline):
+    """Group slides into render segments: the opening slideshow, each narrated section and the closing slideshow."""
+    segments = []
+    for slide in timeline:
+        if slide["audio"] is None and segments and segments[-1][-1]["audio"] is None:
+            segments[-1].append(slide)
+        else:
+            segments.append([slide])
+    return segments
+
+def render_video_segment(segment, profile, output_file, still=True, threads=None):
+    """Encode the slides of one segment (video only) with the shared encoder settings."""
+    video_args, video_filters = _ffmpeg_video_graph(segment, profile)
+    _run_ffmpeg(
+        [get_setting("FFMPEG_BINARY"), "-y", "-loglevel", "error"] + video_args
+        + ["-filter_complex", ";".join(video_filters), "-map", "[vout]", "-an"]
+        + _x264_args(profile, still, threads) + [output_file]
+    )
+    return output_file
+
+def render_with_ffmpeg_segments(timeline, soundtrack, profile, output_file="final_video.mp4", max_workers=None):
+    """Render each segment in its own ffmpeg process in parallel, then join them with a stream-copy concat.
+
+    The soundtrack is mixed over the whole timeline and encoded once while the
+    concatenated video stream is copied, so segment boundaries stay seamless.
+    """
+    segments = split_timeline_segments(timeline)
+    cpu_count = os.cpu_count() or 1
+    workers = max(1, min(max_workers or cpu_count, len(segments)))
+    threads_per_segment = max(1, cpu_count // workers)
+    still = not any(slide["motion"] for slide in timeline)
+
+    with tempfile.TemporaryDirectory(dir=os.path.dirname(os.path.abspath(output_file))) as work_dir:
+        segment_files = [os.path.join(work_dir, f"segment_{i:03d}.mp4") for i in range(len(segments))]
+        # Each worker thread only waits on its own ffmpeg process, so the segments encode in parallel processes
+        with ThreadPoolExecutor(max_workers=workers) as executor:
+            list(executor.map(
+                lambda args: render_video_segment(*args, still=still, threads=threads_per_segment),
+                [(segment, profile, path) for segment, path in zip(segments, segment_files)]
+            ))
+
+        concat_list = os.path.join(work_dir, "segments.txt")
+        with open(concat_list, "w", encoding="utf-8") as f:
+            for path in segment_files:
+                escaped_path = path.replace("'", "'\\''")
+                f.write(f"file '{escaped_path}'\n")
+
+        soundtrack_path = os.path.join(work_dir, "soundtrack.wav")
+        write_wav(soundtrack_path, soundtrack)
+        _run_ffmpeg(
+            [get_setting("FFMPEG_BINARY"), "-y", "-loglevel", "error", "-f", "concat", "-safe", "0", "-i", concat_list,
+             "-i", soundtrack_path, "-map", "0:v", "-map", "1:a", "-c:v", "copy"]
+            + _audio_output_args(timeline, profile["fps"]) + [output_file]
+        )
+    return output_file
+
+def load_manifest(manifest_path):
+    """Load a job manifest, or return None if there is no usable one."""
+    try:
+        with open(manifest_path, encoding="utf-8") as f:
+            return json.load(f)
+    except (OSError, ValueError):
+        return None
+
+def save_manifest(manifest_path, manifest):
+    """Write the job manifest atomically so an interrupted job never leaves it half-written."""
+    tmp_path = f"{manifest_path}.{uuid.uuid4().hex}.tmp"
+    with open(tmp_path, "w", encoding="utf-8") as f:
+        json.dump(manifest, f, indent=2, ensure_ascii=False)
+    os.replace(tmp_path, manifest_path)
+
+def _files_exist(paths):
+    return all(path and os.path.exists(path) for path in paths)
+
+def render_settings(background_music_path, music_volume=0.1):
+    """Inputs besides the slides that change the rendered video, for the render stage's checkpoint key.
+
+    The music file is identified by size and modification time, like the decoded music cache,
+    so replacing a track re-renders even when its path stays the same.
+    """
+    stat = os.stat(background_music_path)
+    return {
+        "music": (os.path.abspath(background_music_path), stat.st_size, stat.st_mtime),
+        "music_volume": music_volume,
+        "duck_gain": MUSIC_DUCK_GAIN,
+        "ken_burns_zoom": KEN_BURNS_ZOOM,
+        "ken_burns_oversample": KEN_BURNS_OVERSAMPLE,
+    }
+
+def run_pipeline(pdf_path, output_dir, image_service, openai_api_key, smallest_api_key, stability_api_key,
+                 background_music_path, render_engine=None, output_profile=None, profiling=None, pdf_workers=None):
+    """Run the whole blog-to-video pipeline for one PDF without the Streamlit UI.
+
+    Progress is checkpointed to output_dir/manifest.json after every stage and
+    section, so re-running the same job resumes from the first incomplete stage
+    and reuses every finished asset. Returns a dict with the output video path,
+    timings (seconds) of the stages executed in this run, the stages reused from
+    the manifest and any per-section errors. profiling is passed on to
+    create_video_with_audio; profiling the whole job is up to the caller.
+    pdf_workers caps the processes used to extract a large PDF.
+    """
+    os.makedirs(output_dir, exist_ok=True)
+    manifest_path = os.path.join(output_dir, "manifest.json")
+    with open(pdf_path, "rb") as pdf_file:
+        pdf_hash = hashlib.sha256(pdf_file.read()).hexdigest()
+
+    manifest = load_manifest(manifest_path)
+    if not manifest or manifest.get("pdf_hash") != pdf_hash:
+        manifest = {"pdf": pdf_path, "pdf_hash": pdf_hash, "stages": {}, "sections": []}
+    stages = manifest["stages"]
+    timings = {}
+    reused = []
+
+    def checkpoint(stage, inputs, fn, *args, valid=None, **kwargs):
+        """Run a stage unless the manifest records it as done for the same inputs."""
+        inputs_key = DiskCache.make_key(inputs)
+        recorded = stages.get(stage)
+        if (recorded and recorded["status"] == "done" and recorded["inputs"] == inputs_key
+                and (valid is None or valid(recorded["result"]))):
+            reused.append(stage)
+            return recorded["result"]
+        stages[stage] = {"status": "pending", "inputs": inputs_key}
+        save_manifest(manifest_path, manifest)
+        start = time.perf_counter()
+        result = fn(*args, **kwargs)
+        timings[stage] = time.perf_counter() - start
+        stages[stage] = {"status": "done", "inputs": inputs_key, "duration": timings[stage], "result": result}
+        save_manifest(manifest_path, manifest)
+        return result
+
+    pdf = checkpoint("ingest", pdf_hash, ingest_pdf, pdf_path, output_dir, workers=pdf_workers,
+                     valid=lambda pdf: _files_exist(pdf["images"]))
+    main_temple_text = extract_main_temple_text(pdf["text"])
+    pdf_images = pdf["images"]
+    full_script = checkpoint("script", main_temple_text, generate_full_script, openai_api_key, main_temple_text)
+    sections_scripts = checkpoint("sections", full_script, split_script_into_sections, full_script)
+
+    # One record per section keeps each script, audio and image together
+    previous = {record["title"]: record for record in manifest["sections"]}
+    records = []
+    for title, script in sections_scripts.items():
+        record = previous.get(title)
+        if not (record and record["status"] == "done" and record["script"] == script
+                and record["image_service"] == image_service
+                and _files_exist([record["audio_path"], record["image_path"]])):
+            record = {"title": title, "script": script, "image_service": image_service, "status": "pending",
+                      "audio_path": None, "image_path": None, "audio_duration": None, "error": None}
+        records.append(record)
+    manifest["sections"] = records
+    save_manifest(manifest_path, manifest)
+
+    stale_sections = {record["title"]: record["script"] for record in records if record["status"] != "done"}
+    if stale_sections:
+        start = time.perf_counter()
+        by_title = {record["title"]: record for record in records}
+        for _, section, _, assets in generate_section_assets(
+            stale_sections, image_service, smallest_api_key, stability_api_key, openai_api_key
+        ):
+            record = by_title[section]
+            record["audio_path"] = assets["audio_path"]
+            record["image_path"] = assets["image_path"]
+            record["audio_duration"] = probe_audio_duration(assets["audio_path"]) if assets["audio_path"] else None
+            record["error"] = None if assets["error"] is None else str(assets["error"])
+            record["status"] = "done" if assets["error"] is None else "failed"
+            save_manifest(manifest_path, manifest)
+        timings["assets"] = time.perf_counter() - start
+    else:
+        reused.append("assets")
+
+    completed = [record for record in records if record["status"] == "done"]
+    section_errors = {record["title"]: record["error"] for record in records if record["status"] != "done"}
+    if not completed:
+        raise ValueError(f"No section assets could be generated: {section_errors}")
+
+    images = [record["image_path"] for record in completed]
+    audios = [record["audio_path"] for record in completed]
+    output_file = os.path.join(output_dir, "final_video.mp4")
+    render_engine = render_engine or RENDER_ENGINE
+    output_profile = output_profile or OUTPUT_PROFILE
+    profiling = get_profiling_mode(profiling)
+    # Profiling is part of the inputs so switching it on re-renders and measures the render
+    output_file = checkpoint(
+        "render", (images, audios, pdf_images, output_file, render_engine, output_profile,
+                   render_settings(background_music_path), profiling),
+        create_video_with_audio, images, audios, background_music_path,
+        pdf_images=pdf_images, output_file=output_file, render_engine=render_engine, output_profile=output_profile,
+        profiling=profiling, valid=lambda path: _files_exist([path])
+    )
+    manifest["output_file"] = output_file
+    save_manifest(manifest_path, manifest)
+    return {"output_file": output_file, "timings": timings, "reused_stages": reused, "section_errors": section_errors}
+
+def get_pipeline_state(pdf_bytes):
+    """Return the pipeline state kept in st.session_state for this PDF upload."""
+    pdf_hash = hashlib.sha256(pdf_bytes).hexdigest()
+    pipelines = st.session_state.setdefault("pipelines", {})
+    pipeline = pipelines.setdefault(pdf_hash, {"pdf_hash": pdf_hash, "stages": {}})
+    pipeline.setdefault("output_dir", os.path.join(APP_OUTPUT_DIR, pdf_hash))
+    os.makedirs(pipeline["output_dir"], exist_ok=True)
+    return pipeline
+
+def is_stage_done(pipeline, name, inputs, valid=None):
+    """Check whether a stage already completed for exactly these inputs and its result is still usable."""
+    stage = pipeline["stages"].get(name)
+    return (stage is not None and stage["status"] == "done" and stage["inputs"] == DiskCache.make_key(inputs)
+            and (valid is None or valid(stage["result"])))
+
+def set_stage(pipeline, name, inputs, status, result=None):
+    pipeline["stages"][name] = {"inputs": DiskCache.make_key(inputs), "status": status, "result": result}
+
+def run_stage(pipeline, name, inputs, fn, *args, valid=None, **kwargs):
+    """Run fn as a pipeline stage, returning the stored result if its inputs are unchanged.
+
+    valid(result) can reject a stored result, e.g. when cache eviction deleted its files.
+    """
+    if is_stage_done(pipeline, name, inputs, valid):
+        return pipeline["stages"][name]["result"]
+    set_stage(pipeline, name, inputs, "pending")
+    result = fn(*args, **kwargs)
+    set_stage(pipeline, name, inputs, "done", result)
+    return result
+
 def main():
     st.title("Temple Heritage Youtube Shorts from Blogs")
 
@@ -372,6 +1899,33 @@ def main():
         key="image_service"
     )
 
+    render_engine = st.radio(
+        "Select Render Engine",
+        RENDER_ENGINES,
+        index=RENDER_ENGINES.index(RENDER_ENGINE) if RENDER_ENGINE in RENDER_ENGINES else 0,
+        key="render_engine"
+    )
+
+    output_profile = st.selectbox(
+        "Output Format",
+        list(OUTPUT_PROFILES),
+        index=list(OUTPUT_PROFILES).index(OUTPUT_PROFILE) if OUTPUT_PROFILE in OUTPUT_PROFILES else 0,
+        format_func=lambda name: OUTPUT_PROFILES[name]["label"],
+        key="output_profile"
+    )
+
+    force_regenerate_images = st.checkbox(
+        "Force regenerate images (ignore image cache)",
+        key="force_regenerate_images"
+    )
+
+    # The app has no job around the pipeline, so PROFILE_RENDER=job also profiles just the render here
+    render_profiling = "render" if st.checkbox(
+        "Profile the render (saves final_video.render.prof and .json)",
+        value=get_profiling_mode() is not None,
+        key="profile_render"
+    ) else None
+
     if not all([openai_api_key, smallest_api_key, background_music_file,stability_api_key]):
         st.error("Missing required environment variables. Please check mdb.env file.")
         return
@@ -386,63 +1940,84 @@ def main():
         st.success("PDF file uploaded successfully!")
 
         try:
-            input_text = extract_text_from_pdf(uploaded_file)
+            pipeline = get_pipeline_state(uploaded_file.getvalue())
+            pdf_hash = pipeline["pdf_hash"]
+            output_dir = pipeline["output_dir"]
+
+            # Text, images and metadata come from a single pass over the PDF
+            pdf = run_stage(pipeline, "ingest", pdf_hash, ingest_pdf, uploaded_file, output_dir,
+                            valid=lambda pdf: _files_exist(pdf["images"]))
+            input_text = pdf["text"]
+            st.caption(f"Parsed {pdf['page_count']} pages in {sum(pdf['page_timings']):.2f}s of page work")
             st.write("Extracted text from PDF:", input_text[:5000])  # Debug print for first 500 characters
-            main_temple_text = input_text.lower().split('main temple')[1].strip() if 'main temple' in input_text.lower() else input_text.strip()
+            main_temple_text = extract_main_temple_text(input_text)
 
             st.subheader("Generated Sections for Main Temple")
 
-             # Extract images from PDF
-            pdf_images = extract_images_from_pdf(uploaded_file)
+            pdf_images = pdf["images"]
             if pdf_images:
                 st.success(f"Extracted {len(pdf_images)} images from PDF")
 
             # Step 1: Generate full script
-            full_script = generate_full_script(openai_api_key, main_temple_text)
+            full_script = run_stage(
+                pipeline, "script", main_temple_text, generate_full_script, openai_api_key, main_temple_text
+            )
             st.write("Generated Full Script:", full_script[:5000])  # Debug print for first 500 characters
 
             # Step 2: Split into sections
-            sections_scripts = split_script_into_sections(full_script)
+            sections_scripts = run_stage(pipeline, "sections", full_script, split_script_into_sections, full_script)
             st.write("Split Sections Scripts:", sections_scripts) # Debug print for sections
 
-            # Ensure the 'images/' directory exists
-            os.makedirs("images", exist_ok=True)
-
             images = []
             audios = []
-            
+
+            # Only sections whose script or image settings changed are regenerated
+            section_inputs = {
+                section: (script, image_service, force_regenerate_images)
+                for section, script in sections_scripts.items()
+            }
+            stale_sections = {
+                section: script for section, script in sections_scripts.items()
+                if not is_stage_done(pipeline, f"assets:{section}", section_inputs[section],
+                                     valid=lambda assets: _files_exist([assets["audio_path"], assets["image_path"]]))
+            }
+            narration_preview = st.empty()
+
+            def preview_narration(i, section, chunk_index, chunk_path):
+                # The opening sentences play while the rest of the narration is still being synthesized
+                if i == 1 and chunk_index == 0:
+                    with narration_preview.container():
+                        st.caption(f"Preview: opening of {section}")
+                        st.audio(chunk_path, format="audio/wav")
+
+            fresh_assets = generate_section_assets(
+                stale_sections, image_service, smallest_api_key, stability_api_key, openai_api_key,
+                force_regenerate_images, on_audio_chunk=preview_narration
+            )
             for i, (section, script) in enumerate(sections_scripts.items(), start=1):
-            #for i, (section, script) in list(enumerate(sections_scripts.items(), start=1))[:1]:
+                stage_name = f"assets:{section}"
+                if section in stale_sections:
+                    _, _, _, assets = next(fresh_assets)
+                    status = "done" if assets["error"] is None else "pending"
+                    set_stage(pipeline, stage_name, section_inputs[section], status, assets)
+                else:
+                    assets = pipeline["stages"][stage_name]["result"]
+
                 st.markdown(f"### {section}")
                 st.text_area(f"Script {i}: {section}", script, height=100, key=f"script_{i}")
 
                 try:
-                    if not script.strip():
-                        raise ValueError(f"The script for {section} is empty. Skipping TTS synthesis.")
+                    if assets["error"] is not None:
+                        raise assets["error"]
 
-                    audio_path = synthesize_tts(smallest_api_key, script)
+                    audio_path = assets["audio_path"]
+                    image_path = assets["image_path"]
                     audios.append(audio_path)
                     st.audio(audio_path, format="audio/wav")
                     st.success(f"Audio for {section} generated and saved at: {audio_path}")
 
-                    #image_url = generate_image_for_text(openai_api_key, script)
-                    #image_path = f"images/{section.lower().replace(' ', '_')}.png"
-                    #with open(image_path, "wb") as img_file:
-                    #    img_file.write(requests.get(image_url).content)
-                    #images.append(image_path)
-                    #st.image(image_url, caption=f"Image for {section}")
-
-                    if image_service == 'Stability AI':
-                            image_path = generate_image_stability(stability_api_key, script, section)
-                            images.append(image_path)
-                            st.image(image_path, caption=f"Image for {section}")
-                    else:
-                            image_url = generate_image_for_text(openai_api_key, script, section)
-                            image_path = f"images/{section.lower().replace(' ', '_')}.png"
-                            with open(image_path, "wb") as img_file:
-                                img_file.write(requests.get(image_url).content)
-                            images.append(image_path)
-                            st.image(image_url, caption=f"Image for {section}")
+                    images.append(image_path)
+                    st.image(image_path, caption=f"Image for {section}")
 
                     st.download_button(
                         label=f"Download Audio for {section}",
@@ -462,6 +2037,16 @@ def main():
 
                 except Exception as e:
                     st.error(f"Error generating assets for {section}: {e}")
+            narration_preview.empty()
+
+            tts_stats = tts_cache.stats()
+            image_stats = image_cache.stats()
+            llm_stats = llm_cache.stats()
+            st.caption(
+                f"Script cache: {llm_stats['hits']} hits, {llm_stats['misses']} misses | "
+                f"TTS cache: {tts_stats['hits']} hits, {tts_stats['misses']} misses | "
+                f"Image cache: {image_stats['hits']} hits, {image_stats['misses']} misses"
+            )
 
             if images and audios:
                 st.subheader("Creating Final Video")
@@ -471,7 +2056,16 @@ def main():
                     #bg_music_path = save_uploaded_file(background_music_file)
                     bg_music_path = background_music_file
                     # Update video creation call
-                    video_path = create_video_with_audio(images, audios, bg_music_path, pdf_images=pdf_images, output_file="final_video.mp4")
+                    output_file = os.path.join(output_dir, "final_video.mp4")
+                    video_path = run_stage(
+                        pipeline, "render",
+                        (images, audios, pdf_images, output_file, render_engine, output_profile,
+                         render_settings(bg_music_path), render_profiling),
+                        create_video_with_audio, images, audios, bg_music_path,
+                        pdf_images=pdf_images, output_file=output_file, render_engine=render_engine,
+                        output_profile=output_profile, profiling=render_profiling,
+                        valid=lambda path: _files_exist([path])
+                    )
                     st.video(video_path)
                     st.success(f"Video created successfully!")
                     st.download_button(
@@ -484,6 +2078,25 @@ def main():
                 except Exception as e:
                     st.error(f"Error creating video: {e}")
 
+            with st.expander("Pipeline stages"):
+                st.write({name: stage["status"] for name, stage in pipeline["stages"].items()})
+
+            snapshot = export_metrics()
+            with st.expander("Metrics"):
+                if snapshot["spans"]:
+                    st.table([
+                        {"span": name, "calls": totals["count"], "errors": totals["errors"],
+                         "total s": round(totals["seconds"], 3), "max s": round(totals["max_seconds"], 3)}
+                        for name, totals in snapshot["spans"].items()
+                    ])
+                st.table([
+                    {"counter": counter["name"], "labels": ", ".join(f"{k}={v}" for k, v in counter["labels"].items()),
+                     "value": counter["value"]}
+                    for counter in snapshot["counters"]
+                ])
+                st.caption(f"Spans are logged to {METRICS_LOG or '(disabled)'}; "
+                           f"Prometheus metrics are written to {METRICS_PROM_FILE or '(disabled)'}")
+
         except Exception as e:
             st.error(f"Error: {e}")
 
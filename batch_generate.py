@@ -0,0 +1,145 @@
+"""Headless batch mode: turn a directory (or glob) of blog PDFs into videos.
+
+Example:
+    python batch_generate.py pdfs/ "archive/Hoysala*.pdf" --output-dir batch_output --workers 4
+"""
+import os
+import sys
+import glob
+import json
+import time
+import argparse
+import traceback
+from concurrent.futures import ProcessPoolExecutor, as_completed
+
+import app
+
+IMAGE_SERVICES = {"stability": "Stability AI", "dalle": "DALL-E"}
+
+
+def collect_pdfs(inputs):
+    """Expand directories and glob patterns into a sorted list of unique PDF paths."""
+    pdf_paths = set()
+    for item in inputs:
+        if os.path.isdir(item):
+            pdf_paths.update(glob.glob(os.path.join(item, "*.pdf")))
+        else:
+            pdf_paths.update(path for path in glob.glob(item) if path.lower().endswith(".pdf"))
+    return sorted(pdf_paths)
+
+
+def job_dir_for(pdf_path, output_dir):
+    return os.path.join(output_dir, os.path.splitext(os.path.basename(pdf_path))[0])
+
+
+def run_job(pdf_path, job_dir, image_service, render_engine=None, output_profile=None, profiling=None,
+            pdf_workers=None):
+    """Run the pipeline for one PDF in a worker process and report its outcome.
+
+    profiling="job" saves final_video.job.prof for the whole job, "render" just for the render.
+    pdf_workers is this job's share of the PDF extraction processes.
+    """
+    start = time.perf_counter()
+    job = {"pdf": pdf_path, "output_dir": job_dir}
+    app.reset_metrics()
+    profiling = app.get_profiling_mode(profiling)
+    try:
+        with app.profiled(os.path.join(job_dir, "final_video.mp4"), "job", enabled=profiling == "job"):
+            result = app.run_pipeline(
+                pdf_path,
+                job_dir,
+                image_service,
+                os.getenv('OPENAI_API_KEY'),
+                os.getenv('SMALLEST_API_KEY'),
+                os.getenv('STABILITY_API_KEY'),
+                os.getenv('BACKGROUND_MUSIC'),
+                render_engine=render_engine,
+                output_profile=output_profile,
+                profiling=profiling,
+                pdf_workers=pdf_workers,
+            )
+        job.update(status="ok", **result)
+    except Exception as e:
+        job.update(status="failed", error=str(e), traceback=traceback.format_exc())
+    job["elapsed"] = time.perf_counter() - start
+    os.makedirs(job_dir, exist_ok=True)
+    job["metrics"] = app.export_metrics(os.path.join(job_dir, "metrics.prom"))
+    return job
+
+
+def parse_args(argv=None):
+    parser = argparse.ArgumentParser(description="Generate temple videos for a batch of blog PDFs.")
+    parser.add_argument("inputs", nargs="+", help="PDF files, directories of PDFs or glob patterns")
+    parser.add_argument("--output-dir", default="batch_output", help="Directory that receives one folder per PDF")
+    parser.add_argument("--workers", type=int, default=os.cpu_count() or 1, help="Number of worker processes")
+    parser.add_argument("--image-service", choices=sorted(IMAGE_SERVICES), default="stability")
+    parser.add_argument("--render-engine", choices=app.RENDER_ENGINES, default=app.RENDER_ENGINE,
+                        help="Video renderer (default: RENDER_ENGINE from mdb.env or moviepy)")
+    parser.add_argument("--profile", choices=list(app.OUTPUT_PROFILES), default=app.OUTPUT_PROFILE,
+                        help="Output profile: canvas size, frame rate and encoder preset (default: shorts)")
+    parser.add_argument("--profiling", choices=app.PROFILE_MODES, default=app.get_profiling_mode(),
+                        help="Save a cProfile of each render or whole job next to its video (default: PROFILE_RENDER)")
+    parser.add_argument("--summary", help="Where to write the JSON summary (default: <output-dir>/summary.json)")
+    return parser.parse_args(argv)
+
+
+def main(argv=None):
+    args = parse_args(argv)
+
+    missing = [name for name in ('OPENAI_API_KEY', 'SMALLEST_API_KEY', 'BACKGROUND_MUSIC', 'STABILITY_API_KEY')
+               if not os.getenv(name)]
+    if missing:
+        print(f"Missing required environment variables: {', '.join(missing)}. Please check mdb.env file.")
+        return 2
+
+    pdf_paths = collect_pdfs(args.inputs)
+    if not pdf_paths:
+        print("No PDF files found.")
+        return 2
+
+    os.makedirs(args.output_dir, exist_ok=True)
+    image_service = IMAGE_SERVICES[args.image_service]
+    workers = max(1, min(args.workers, len(pdf_paths)))
+    # Jobs already run in parallel, so they split the PDF extraction processes instead of each starting a full pool
+    pdf_workers = max(1, app.PDF_EXTRACT_WORKERS // workers)
+    print(f"Processing {len(pdf_paths)} PDFs with {workers} workers")
+
+    start = time.perf_counter()
+    jobs = []
+    # Workers share the parent's provider limiters, so all jobs draw from one rate limit per provider
+    with ProcessPoolExecutor(max_workers=workers, initializer=app.share_provider_limiters,
+                             initargs=(app.provider_limiters,)) as executor:
+        futures = [
+            executor.submit(
+                run_job, pdf_path, job_dir_for(pdf_path, args.output_dir), image_service,
+                args.render_engine, args.profile, args.profiling, pdf_workers
+            )
+            for pdf_path in pdf_paths
+        ]
+        for future in as_completed(futures):
+            job = future.result()
+            jobs.append(job)
+            detail = job.get("output_file") if job["status"] == "ok" else job["error"]
+            print(f"[{len(jobs)}/{len(pdf_paths)}] {job['status']:6} {job['elapsed']:7.1f}s  {job['pdf']}: {detail}")
+
+    jobs.sort(key=lambda job: job["pdf"])
+    failed = [job for job in jobs if job["status"] != "ok"]
+    summary = {
+        "total": len(jobs),
+        "succeeded": len(jobs) - len(failed),
+        "failed": len(failed),
+        "workers": workers,
+        "wall_time": time.perf_counter() - start,
+        "jobs": jobs,
+    }
+    summary_path = args.summary or os.path.join(args.output_dir, "summary.json")
+    with open(summary_path, "w", encoding="utf-8") as f:
+        json.dump(summary, f, indent=2, ensure_ascii=False)
+
+    print(f"{summary['succeeded']}/{summary['total']} videos generated in {summary['wall_time']:.1f}s. "
+          f"Summary written to {summary_path}")
+    return 1 if failed else 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
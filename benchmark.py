@@ -0,0 +1,233 @@
+"""Offline end-to-end benchmark: run the real app.py pipeline against local stand-in providers.
+
+Every stage (ingest, script, sections, assets, render) is measured for wall
+time, CPU time of the process and of its ffmpeg/worker children, and peak RSS.
+
+Example:
+    python benchmark.py --runs 3 --render-engine ffmpeg --latency 0.5 --failure-rate 0.05
+"""
+import os
+import sys
+import glob
+import json
+import time
+import argparse
+import resource
+import tempfile
+import statistics
+from contextlib import contextmanager
+
+import fake_providers
+
+ROOT = os.path.dirname(os.path.abspath(__file__))
+STAGES = ("ingest", "script", "sections", "assets", "render")
+CACHE_NAMES = ("tts_cache", "image_cache", "slide_cache", "music_cache", "llm_cache")
+
+
+def reset_peak_rss():
+    """Reset the kernel's peak RSS counter (VmHWM) so each stage reports its own peak; Linux only."""
+    try:
+        with open("/proc/self/clear_refs", "w") as f:
+            f.write("5")
+        return True
+    except OSError:
+        return False
+
+
+def peak_rss_mb():
+    try:
+        with open("/proc/self/status") as f:
+            for line in f:
+                if line.startswith("VmHWM:"):
+                    return int(line.split()[1]) / 1024
+    except OSError:
+        pass
+    # Lifetime peak (KiB on Linux) when the per-stage counter is unavailable
+    return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024
+
+
+def children_cpu_time():
+    usage = resource.getrusage(resource.RUSAGE_CHILDREN)
+    return usage.ru_utime + usage.ru_stime
+
+
+@contextmanager
+def measure(stats, stage):
+    """Record wall time, CPU time (own and children's) and peak RSS of the enclosed block under stats[stage]."""
+    reset_peak_rss()
+    wall, cpu, child_cpu = time.perf_counter(), time.process_time(), children_cpu_time()
+    try:
+        yield
+    finally:
+        stats[stage] = {
+            "wall": time.perf_counter() - wall,
+            "cpu": time.process_time() - cpu,
+            "child_cpu": children_cpu_time() - child_cpu,
+            "peak_rss_mb": peak_rss_mb(),
+        }
+
+
+def instrument_stages(app, current):
+    """Wrap the pipeline's stage functions in app so each call is measured into current["stats"]."""
+    def wrap(stage, fn):
+        def measured(*args, **kwargs):
+            with measure(current["stats"], stage):
+                return fn(*args, **kwargs)
+        return measured
+
+    def wrap_generator(stage, fn):
+        def measured(*args, **kwargs):
+            with measure(current["stats"], stage):
+                yield from fn(*args, **kwargs)
+        return measured
+
+    app.ingest_pdf = wrap("ingest", app.ingest_pdf)
+    app.generate_full_script = wrap("script", app.generate_full_script)
+    app.split_script_into_sections = wrap("sections", app.split_script_into_sections)
+    app.generate_section_assets = wrap_generator("assets", app.generate_section_assets)
+    app.create_video_with_audio = wrap("render", app.create_video_with_audio)
+
+
+def use_fresh_caches(app, cache_dir):
+    """Point every on-disk cache at an empty directory so the run starts cold."""
+    for name in CACHE_NAMES:
+        cache = getattr(app, name)
+        setattr(app, name, app.DiskCache(os.path.join(cache_dir, name), cache.max_bytes, cache.suffix))
+
+
+def configure_environment(work_dir, urls):
+    """Point app.py at the stand-in providers and keep its caches inside work_dir; must run before importing app."""
+    os.environ.update({
+        "OPENAI_API_KEY": "benchmark",
+        "SMALLEST_API_KEY": "benchmark",
+        "STABILITY_API_KEY": "benchmark",
+        "OPENAI_API_BASE": urls["openai_api_base"],
+        "STABILITY_API_URL": urls["stability_api_url"],
+        "METRICS_LOG": os.path.join(work_dir, "spans.jsonl"),
+        "METRICS_PROM_FILE": os.path.join(work_dir, "metrics.prom"),
+    })
+    for name in CACHE_NAMES:
+        os.environ[f"{name[:-len('_cache')].upper()}_CACHE_DIR"] = os.path.join(work_dir, "cache", name)
+
+
+def summarize(runs):
+    """Median of each stage metric over all runs that executed the stage."""
+    summary = {}
+    for stage in STAGES + ("total",):
+        measured = [run["stages"][stage] for run in runs if stage in run["stages"]]
+        if measured:
+            summary[stage] = {
+                metric: statistics.median(entry[metric] for entry in measured) for metric in measured[0]
+            }
+    return summary
+
+
+def print_table(title, stages):
+    print(f"\n{title}")
+    print(f"  {'stage':10} {'wall s':>9} {'cpu s':>9} {'child cpu s':>12} {'peak RSS MB':>12}")
+    for stage in STAGES + ("total",):
+        if stage in stages:
+            entry = stages[stage]
+            print(f"  {stage:10} {entry['wall']:9.2f} {entry['cpu']:9.2f} {entry['child_cpu']:12.2f} "
+                  f"{entry['peak_rss_mb']:12.1f}")
+
+
+def parse_args(argv=None):
+    parser = argparse.ArgumentParser(description="Benchmark the video pipeline offline against stand-in providers.")
+    parser.add_argument("pdfs", nargs="*", help="PDFs to convert (default: the bundled Hoysala PDFs)")
+    parser.add_argument("--music", nargs="+", help="Background tracks, used round-robin (default: music/*.wav)")
+    parser.add_argument("--runs", type=int, default=1, help="Runs per PDF")
+    parser.add_argument("--cache", choices=("cold", "warm"), default="cold",
+                        help="cold: every run starts with empty caches; warm: runs share caches")
+    parser.add_argument("--image-service", choices=("stability", "dalle"), default="stability")
+    parser.add_argument("--render-engine", help="Video renderer (default: RENDER_ENGINE)")
+    parser.add_argument("--profile", help="Output profile (default: OUTPUT_PROFILE)")
+    parser.add_argument("--profiling", choices=("render", "job"),
+                        help="cProfile each render or whole run; writes final_video.<render|job>.prof and .json "
+                             "(default: PROFILE_RENDER)")
+    parser.add_argument("--work-dir", help="Where videos, caches and results go (default: a new temp directory)")
+    parser.add_argument("--output", help="Results JSON (default: <work-dir>/benchmark_results.json)")
+    fake_providers.add_config_arguments(parser)
+    return parser.parse_args(argv)
+
+
+def main(argv=None):
+    args = parse_args(argv)
+    pdf_paths = args.pdfs or sorted(glob.glob(os.path.join(ROOT, "*.pdf")))
+    music_paths = args.music or sorted(glob.glob(os.path.join(ROOT, "music", "*.wav")))
+    if not pdf_paths or not music_paths:
+        print("No PDFs or background music found.")
+        return 2
+
+    work_dir = args.work_dir or tempfile.mkdtemp(prefix="indicvideogen-benchmark-")
+    server = fake_providers.start_fake_providers(**fake_providers.config_from_args(args))
+    urls = fake_providers.provider_urls(server.base_url)
+    configure_environment(work_dir, urls)
+
+    import app
+    import smallestai.waves.waves_client as waves_client
+    # The Waves SDK has no base URL setting, so its module constant is redirected for the benchmark
+    waves_client.API_BASE_URL = urls["waves_api_base"]
+
+    profiling = app.get_profiling_mode(args.profiling)
+    image_service = {"stability": "Stability AI", "dalle": "DALL-E"}[args.image_service]
+    current = {"stats": None}
+    instrument_stages(app, current)
+
+    runs = []
+    for run_index in range(args.runs):
+        for job_index, pdf_path in enumerate(pdf_paths):
+            job_name = f"run{run_index + 1}-{os.path.splitext(os.path.basename(pdf_path))[0]}"
+            if args.cache == "cold":
+                use_fresh_caches(app, os.path.join(work_dir, "cache", job_name))
+            current["stats"] = stats = {}
+            app.reset_metrics()
+            run = {"pdf": pdf_path, "run": run_index + 1, "stages": stats}
+            try:
+                with measure(stats, "total"), app.profiled(os.path.join(work_dir, job_name, "final_video.mp4"), "job",
+                                                           enabled=profiling == "job"):
+                    result = app.run_pipeline(
+                        pdf_path, os.path.join(work_dir, job_name), image_service,
+                        os.environ["OPENAI_API_KEY"], os.environ["SMALLEST_API_KEY"], os.environ["STABILITY_API_KEY"],
+                        music_paths[job_index % len(music_paths)],
+                        render_engine=args.render_engine, output_profile=args.profile, profiling=profiling,
+                    )
+                run.update(status="ok", output_file=result["output_file"], section_errors=result["section_errors"])
+                render_summary = os.path.splitext(result["output_file"])[0] + ".render.json"
+                # A render reused from the manifest leaves the summary of an earlier run behind
+                if profiling and "render" in result["timings"] and os.path.exists(render_summary):
+                    with open(render_summary, encoding="utf-8") as f:
+                        run["render_profile"] = {key: value for key, value in json.load(f).items()
+                                                 if key != "top_functions"}
+            except Exception as e:
+                run.update(status="failed", error=str(e))
+            # Stages reset the peak counter, so the job's peak is the largest stage peak
+            stats["total"]["peak_rss_mb"] = max(entry["peak_rss_mb"] for entry in stats.values())
+            run["metrics"] = app.export_metrics(os.path.join(work_dir, job_name, "metrics.prom"))
+            runs.append(run)
+            print_table(f"{job_name}: {run['status']}", stats)
+            if "render_profile" in run:
+                render = run["render_profile"]
+                print(f"  render profile: {render['frames']} frames, {render['encode_ms_per_frame']:.1f} ms/frame wall, "
+                      f"{render['encode_cpu_ms_per_frame']:.1f} ms/frame CPU")
+
+    results = {
+        "config": vars(args),
+        "provider_urls": urls,
+        "provider_counters": dict(server.counters),
+        "runs": runs,
+        "summary": summarize([run for run in runs if run["status"] == "ok"]),
+    }
+    server.shutdown()
+    print_table(f"Median over {len(runs)} runs", results["summary"])
+    print(f"\nProvider requests: {results['provider_counters']}")
+
+    output_path = args.output or os.path.join(work_dir, "benchmark_results.json")
+    with open(output_path, "w", encoding="utf-8") as f:
+        json.dump(results, f, indent=2, ensure_ascii=False)
+    print(f"Results written to {output_path}")
+    return 1 if any(run["status"] != "ok" for run in runs) else 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,237 @@
+"""Local stand-ins for the OpenAI, Stability AI and Smallest Waves endpoints used by app.py.
+
+They let the pipeline run (and be benchmarked) without network access or API
+credits. Latency, failure rate and payload sizes are configurable.
+
+Example:
+    python fake_providers.py --port 8089 --latency 0.5 --failure-rate 0.05
+"""
+import io
+import json
+import math
+import time
+import wave
+import random
+import argparse
+import threading
+from http.server import ThreadingHTTPServer, BaseHTTPRequestHandler
+
+import numpy as np
+from PIL import Image
+
+DEFAULT_CONFIG = {
+    "latency": 0.2,               # mean seconds before each provider responds
+    "jitter": 0.25,               # latency varies uniformly by +/- this fraction
+    "failure_rate": 0.0,          # fraction of provider requests answered with 429 or 503
+    "retry_after": 1,             # Retry-After seconds sent with 429 responses
+    "image_size": 1024,           # generated images are image_size x image_size pixels
+    "audio_seconds_per_char": 0.06,
+    "script_paragraphs": 5,
+    "script_sentences": 3,        # sentences per script paragraph
+}
+
+SENTENCE = (
+    "The Hoysala craftsmen carved every pillar of the ran-ga-man-da-pa from a single block of soapstone, "
+    "and pilgrims still gather here at dawn."
+)
+
+
+def make_png(size, seed=0, grain=4):
+    """Photo-like PNG of size x size pixels: smooth colour regions with light grain.
+
+    Like a generated image it compresses well in the video encoder, yet the
+    grain keeps the PNG about as large as a real one (~1.4 MB at 1024x1024).
+    """
+    rng = np.random.default_rng(seed)
+    coarse = Image.fromarray(rng.integers(0, 256, (6, 6, 3), dtype=np.uint8)).resize((size, size), Image.BICUBIC)
+    pixels = np.asarray(coarse, dtype=np.int16) + rng.integers(-grain, grain + 1, (size, size, 1), dtype=np.int16)
+    buffer = io.BytesIO()
+    Image.fromarray(np.clip(pixels, 0, 255).astype(np.uint8)).save(buffer, format="PNG", compress_level=1)
+    return buffer.getvalue()
+
+
+def make_speech_pcm(seconds, sample_rate):
+    """16-bit mono PCM with a speech-like amplitude envelope."""
+    t = np.arange(int(seconds * sample_rate)) / sample_rate
+    envelope = 0.5 + 0.5 * np.sin(2 * math.pi * 3 * t)
+    signal = 0.3 * envelope * np.sin(2 * math.pi * 180 * t)
+    return (signal * 32767).astype("<i2").tobytes()
+
+
+def make_wav(pcm, sample_rate):
+    buffer = io.BytesIO()
+    with wave.open(buffer, "wb") as wav_file:
+        wav_file.setnchannels(1)
+        wav_file.setsampwidth(2)
+        wav_file.setframerate(sample_rate)
+        wav_file.writeframes(pcm)
+    return buffer.getvalue()
+
+
+def make_script(paragraphs, sentences):
+    return "\n\n".join(" ".join([SENTENCE] * sentences) for _ in range(paragraphs))
+
+
+class FakeProviderHandler(BaseHTTPRequestHandler):
+    protocol_version = "HTTP/1.1"
+
+    @property
+    def config(self):
+        return self.server.config
+
+    def log_message(self, format, *args):
+        pass
+
+    def _send(self, status, body, content_type, headers=None):
+        self.send_response(status)
+        self.send_header("Content-Type", content_type)
+        self.send_header("Content-Length", str(len(body)))
+        for name, value in (headers or {}).items():
+            self.send_header(name, value)
+        self.end_headers()
+        self.wfile.write(body)
+        self.server.count("bytes_sent", len(body))
+
+    def _send_json(self, status, payload, headers=None):
+        self._send(status, json.dumps(payload).encode("utf-8"), "application/json", headers)
+
+    def _read_body(self):
+        return self.rfile.read(int(self.headers.get("Content-Length") or 0))
+
+    def _simulate_provider(self, provider):
+        """Sleep for the configured latency; return False after sending an injected failure."""
+        self.server.count(f"{provider}_requests")
+        latency = self.config["latency"] * random.uniform(1 - self.config["jitter"], 1 + self.config["jitter"])
+        time.sleep(max(0.0, latency))
+        if random.random() < self.config["failure_rate"]:
+            self.server.count(f"{provider}_failures")
+            if random.random() < 0.5:
+                self._send_json(429, {"error": {"message": "Rate limit reached"}},
+                                {"Retry-After": str(self.config["retry_after"])})
+            else:
+                self._send_json(503, {"error": {"message": "Service unavailable"}})
+            return False
+        return True
+
+    def do_GET(self):
+        if self.path.startswith("/files/"):
+            self._send(200, self.server.png, "image/png")
+        else:
+            self._send_json(404, {"error": {"message": f"Unknown path {self.path}"}})
+
+    def do_POST(self):
+        body = self._read_body()
+        if self.path.endswith("/chat/completions"):
+            self.chat_completion(json.loads(body))
+        elif self.path.endswith("/images/generations"):
+            self.image_generation()
+        elif self.path.endswith("/stable-image/generate/sd3"):
+            self.stability_generation()
+        elif self.path.endswith("/get_speech"):
+            self.speech(json.loads(body))
+        else:
+            self._send_json(404, {"error": {"message": f"Unknown path {self.path}"}})
+
+    def chat_completion(self, request):
+        if not self._simulate_provider("openai"):
+            return
+        content = make_script(self.config["script_paragraphs"], self.config["script_sentences"])
+        self._send_json(200, {
+            "id": "chatcmpl-fake",
+            "object": "chat.completion",
+            "created": int(time.time()),
+            "model": request.get("model"),
+            "choices": [{"index": 0, "message": {"role": "assistant", "content": content}, "finish_reason": "stop"}],
+            "usage": {"prompt_tokens": 0, "completion_tokens": 0, "total_tokens": 0},
+        })
+
+    def image_generation(self):
+        if not self._simulate_provider("dalle"):
+            return
+        host = self.headers.get("Host")
+        self._send_json(200, {"created": int(time.time()), "data": [{"url": f"http://{host}/files/image.png"}]})
+
+    def stability_generation(self):
+        if not self._simulate_provider("stability"):
+            return
+        self._send(200, self.server.png, "image/png")
+
+    def speech(self, request):
+        if not self._simulate_provider("smallest"):
+            return
+        sample_rate = int(request.get("sample_rate") or 24000)
+        pcm = make_speech_pcm(len(request.get("text", "")) * self.config["audio_seconds_per_char"], sample_rate)
+        # Older Waves SDKs ask for raw PCM and add the WAV header themselves
+        if request.get("add_wav_header") is False:
+            self._send(200, pcm, "audio/pcm")
+        else:
+            self._send(200, make_wav(pcm, sample_rate), "audio/wav")
+
+
+class FakeProviderServer(ThreadingHTTPServer):
+    daemon_threads = True
+
+    def __init__(self, address, config):
+        super().__init__(address, FakeProviderHandler)
+        self.config = config
+        self.png = make_png(config["image_size"])
+        self.counters = {}
+        self._counter_lock = threading.Lock()
+
+    def count(self, name, amount=1):
+        with self._counter_lock:
+            self.counters[name] = self.counters.get(name, 0) + amount
+
+    @property
+    def base_url(self):
+        return f"http://{self.server_address[0]}:{self.server_address[1]}"
+
+
+def start_fake_providers(host="127.0.0.1", port=0, **overrides):
+    """Start the stand-in providers on a background thread and return the server (see server.base_url)."""
+    unknown = set(overrides) - set(DEFAULT_CONFIG)
+    if unknown:
+        raise ValueError(f"Unknown fake provider settings: {', '.join(sorted(unknown))}")
+    server = FakeProviderServer((host, port), dict(DEFAULT_CONFIG, **overrides))
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    return server
+
+
+def provider_urls(base_url):
+    """Endpoint settings that point app.py at the stand-ins."""
+    return {
+        "openai_api_base": f"{base_url}/v1",
+        "stability_api_url": f"{base_url}/v2beta/stable-image/generate/sd3",
+        "waves_api_base": f"{base_url}/api/v1",
+    }
+
+
+def add_config_arguments(parser):
+    """Add one --option per DEFAULT_CONFIG setting."""
+    for name, default in DEFAULT_CONFIG.items():
+        parser.add_argument(f"--{name.replace('_', '-')}", type=type(default), default=default)
+
+
+def config_from_args(args):
+    return {name: getattr(args, name) for name in DEFAULT_CONFIG}
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Serve local stand-ins for the OpenAI, Stability AI and Waves APIs.")
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=8089)
+    add_config_arguments(parser)
+    args = parser.parse_args(argv)
+    server = FakeProviderServer((args.host, args.port), config_from_args(args))
+    for name, url in provider_urls(server.base_url).items():
+        print(f"{name}: {url}")
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        server.server_close()
+
+
+if __name__ == "__main__":
+    main()